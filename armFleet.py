@@ -0,0 +1,195 @@
+"""
+Fleet of drawing arms served by one bot.
+
+ARM_FLEET names a JSON file listing the arms, each with its CLP endpoint,
+the corners of its drawing area and its start point:
+
+    [
+        {"name": "arm1", "host": "192.168.0.10", "port": 2000,
+         "upper_left_edge": [170, 65, -118, -3, 88, -2],
+         "bottom_right_edge": [601, 403, -118, -3, 88, -2],
+         "ponto_inicial": [170, 65, -100, -3, 88, -2]},
+        {"name": "arm2", "host": "192.168.0.11"}
+    ]
+
+Missing fields take the values of the single-arm setup (CLP_IP, CLP_PORT
+and the calibration the bot always used). Without ARM_FLEET the fleet is
+just that one arm.
+
+Drawings are planned once, in the drawing area of the first arm, and
+remapped onto the area of whichever arm draws them.
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass, field
+import numpy as np
+from dotenv import load_dotenv
+from plcBridge import CLP_IP, CLP_PORT, Ponto_inicial, SessaoCLP
+
+# Load variables from .env into the environment
+load_dotenv()
+
+ARM_FLEET = os.getenv('ARM_FLEET', '')  # JSON file listing the arms, empty for the single arm at CLP_IP
+
+# Calibration of the drawing area on the original arm
+UPPER_LEFT_EDGE = [170, 65, -118, -3, 88, -2]
+BOTTOM_RIGHT_EDGE = [601, 403, -118, -3, 88, -2]
+
+
+@dataclass(slots=True)
+class ArmConfig:
+    """Endpoint and calibration of one arm."""
+    name: str
+    host: str = CLP_IP
+    port: int = CLP_PORT
+    upper_left_edge: list = field(default_factory=lambda: list(UPPER_LEFT_EDGE))
+    bottom_right_edge: list = field(default_factory=lambda: list(BOTTOM_RIGHT_EDGE))
+    ponto_inicial: list = field(default_factory=lambda: list(Ponto_inicial))
+
+
+def load_fleet_config(path=ARM_FLEET):
+    """
+    Read the arm list from a JSON file.
+
+    Returns:
+        list: ArmConfig per arm, a single default arm when path is empty
+    """
+    if not path:
+        return [ArmConfig(name='arm1')]
+    with open(path) as f:
+        entries = json.load(f)
+    if not entries:
+        raise ValueError(f"{path} does not list any arm")
+
+    configs = []
+    for i, entry in enumerate(entries, start=1):
+        entry = dict(entry)
+        entry.setdefault('name', f'arm{i}')
+        for corner in ('upper_left_edge', 'bottom_right_edge', 'ponto_inicial'):
+            if corner in entry and len(entry[corner]) != 6:
+                raise ValueError(f"{entry['name']}: {corner} must have 6 axes [x, y, z, a, e, r]")
+        configs.append(ArmConfig(**entry))
+
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Arm names in {path} must be unique: {names}")
+    return configs
+
+
+def remap_points(points, source, target):
+    """
+    Move a path planned in one drawing area onto another.
+
+    x and y are scaled by the same factor, so the drawing keeps its
+    proportions, and centred in the target area. z keeps its height above
+    the drawing plane, so pen-up moves stay pen-up, and the wrist axes
+    take the target's values.
+
+    Args:
+        points (list): Path as [x, y, z, a, e, r] points
+        source (ArmConfig): Arm whose drawing area the path was planned for
+        target (ArmConfig): Arm that will draw it
+
+    Returns:
+        list: The remapped path, or `points` itself when the areas are the same
+    """
+    if (source.upper_left_edge == target.upper_left_edge
+            and source.bottom_right_edge == target.bottom_right_edge) or not points:
+        return points
+
+    src_ul, src_br = np.array(source.upper_left_edge, float), np.array(source.bottom_right_edge, float)
+    dst_ul, dst_br = np.array(target.upper_left_edge, float), np.array(target.bottom_right_edge, float)
+    ratios = (dst_br[:2] - dst_ul[:2]) / (src_br[:2] - src_ul[:2])
+    # One scale for both axes, keeping each axis' direction
+    factor = np.sign(ratios) * np.min(np.abs(ratios))
+
+    array = np.asarray(points, float)
+    remapped = np.empty_like(array)
+    remapped[:, :2] = (dst_ul[:2] + dst_br[:2]) / 2 + (array[:, :2] - (src_ul[:2] + src_br[:2]) / 2) * factor
+    remapped[:, 2] = array[:, 2] + (dst_ul[2] - src_ul[2])
+    remapped[:, 3:] = dst_ul[3:]
+    return np.rint(remapped).astype(int).tolist()
+
+
+class Arm:
+    """One arm of the fleet: its CLP session, the drawing it is busy with and its usage."""
+
+    def __init__(self, config):
+        self.config = config
+        self.sessao = SessaoCLP(config.host, config.port, config.ponto_inicial)
+        self.current = None       # QueuedDraw being drawn, None when idle
+        self.busy_since = None
+        self.busy_seconds = 0.0   # Finished drawing time since startup
+        self.online_since = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def name(self):
+        return self.config.name
+
+    @property
+    def healthy(self):
+        return self.sessao.saudavel
+
+    @property
+    def idle(self):
+        return self.current is None
+
+    def begin(self, entry):
+        self.current = entry
+        self.busy_since = time.monotonic()
+
+    def finish(self, ok):
+        self.busy_seconds += time.monotonic() - self.busy_since
+        self.current = None
+        self.busy_since = None
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def utilization(self):
+        """Fraction of the time since startup spent drawing."""
+        now = time.monotonic()
+        busy = self.busy_seconds + (now - self.busy_since if self.busy_since is not None else 0.0)
+        return busy / max(now - self.online_since, 1e-9)
+
+    def status(self):
+        if not self.healthy:
+            return f"offline ({self.sessao.ultimo_erro})"
+        if self.current is not None:
+            return f"drawing job {self.current.job.job_id}"
+        return "idle"
+
+
+class ArmFleet:
+    """The arms the bot can draw on, with the first one as the planning reference."""
+
+    def __init__(self, configs=None):
+        self.arms = [Arm(config) for config in (configs or load_fleet_config())]
+
+    @property
+    def reference(self):
+        """Arm whose drawing area the pipeline plans in."""
+        return self.arms[0].config
+
+    def start(self):
+        """Watch every arm's link, so offline arms are noticed before a job is sent to them."""
+        for arm in self.arms:
+            arm.sessao.iniciar_heartbeat()
+
+    async def stop(self):
+        for arm in self.arms:
+            await arm.sessao.encerrar()
+
+    def pick(self):
+        """The least-loaded healthy idle arm, or None if every arm is busy or offline."""
+        candidates = [arm for arm in self.arms if arm.idle and arm.healthy]
+        return min(candidates, key=Arm.utilization, default=None)
+
+    def points_for(self, arm, points):
+        """The path planned in the reference area, remapped for `arm`."""
+        return remap_points(points, self.reference, arm.config)
@@ -0,0 +1,118 @@
+"""
+Offline throughput benchmark for makeDraw.
+
+Replays recorded point lists through plcBridge.makeDraw against the local
+PLC simulator and reports the total time, points per second and how long
+the simulated arm spent moving versus waiting for commands. Point lists can
+be robot_commands.txt files written by the pipeline, JSON lists of points
+or the MOVES_LOG of drawEstimator (one drawing per line).
+
+    python benchDraw.py steps/<user>/<job>/robot_commands.txt --speed 100 --modes stream,blocking
+
+STREAM_WINDOW, ARRIVAL_TOLERANCE and SETTLE_TIME are read from the
+environment as usual, so their effect can be measured too.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import plcBridge
+from plcSimulator import PLCSimulator
+from pathOptimizer import optimize_stroke_order
+
+
+def load_paths(path):
+    """Read the point lists stored in a file as (name, points) pairs."""
+    name = os.path.basename(path)
+    if path.endswith('.jsonl'):
+        with open(path) as f:
+            return [(f'{name}:{i}', json.loads(line)['points']) for i, line in enumerate(f, start=1) if line.strip()]
+    if path.endswith('.json'):
+        with open(path) as f:
+            return [(name, json.load(f))]
+    with open(path) as f:
+        return [(name, [[round(float(v)) for v in line.split(',')] for line in f if line.strip()])]
+
+
+async def run_benchmark(paths, modes, speed, latency, jitter):
+    """
+    Draw every path in every mode on a fresh simulated arm.
+
+    Args:
+        paths (list): (name, points) pairs
+        modes (list): 'stream' and/or 'blocking'
+        speed (float): Simulated axis speed in units per second
+        latency (float): Simulated command latency in seconds
+        jitter (float): Maximum extra random latency in seconds
+
+    Returns:
+        list: One result dict per path and mode
+    """
+    simulator = PLCSimulator(speed, latency, jitter)
+    port = await simulator.start()
+    session = plcBridge.SessaoCLP('127.0.0.1', port)
+
+    results = []
+    try:
+        for name, points in paths:
+            for mode in modes:
+                simulator.reset_stats()
+                started = time.perf_counter()
+                await plcBridge.makeDraw(points, stream=mode == 'stream', sessao=session)
+                total = time.perf_counter() - started
+                results.append({
+                    'path': name,
+                    'mode': mode,
+                    'points': len(points),
+                    'total_time': total,
+                    'points_per_second': len(points) / total if total else 0.0,
+                    'moving_time': simulator.moving_time,
+                    'idle_time': simulator.idle_time,
+                })
+    finally:
+        await session.encerrar()
+        await simulator.close()
+    return results
+
+
+def _print_results(results):
+    print(f"{'path':<32} {'mode':<9} {'points':>7} {'total s':>9} {'points/s':>9} {'moving s':>9} {'idle s':>9}")
+    for r in results:
+        print(f"{r['path'][:32]:<32} {r['mode']:<9} {r['points']:>7} {r['total_time']:>9.2f} "
+              f"{r['points_per_second']:>9.2f} {r['moving_time']:>9.2f} {r['idle_time']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay point lists through makeDraw on a simulated CLP.')
+    parser.add_argument('files', nargs='+', help='robot_commands.txt, .json or .jsonl point lists')
+    parser.add_argument('--modes', default='stream', help='Comma separated: stream, blocking')
+    parser.add_argument('--speed', type=float, default=100.0, help='Axis speed in units per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='Command latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum extra random latency in seconds')
+    parser.add_argument('--limit', type=int, help='Only draw the first N points of each path')
+    parser.add_argument('--optimize', action='store_true', help='Also replay each path after stroke reordering')
+    parser.add_argument('--distance-threshold', type=float, default=3, help='distance_threshold for --optimize')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    paths = []
+    for file in args.files:
+        for name, points in load_paths(file):
+            points = points[:args.limit] if args.limit else points
+            paths.append((name, points))
+            if args.optimize:
+                optimized, _ = optimize_stroke_order(points, args.distance_threshold)
+                paths.append((f'{name} (optimized)', optimized))
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    results = asyncio.run(run_benchmark(paths, modes, args.speed, args.latency, args.jitter))
+    _print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Benchmark of the image-to-points pipeline.
+
+Runs drawPipeline.run_pipeline over the sample images in assets/ and over
+synthetic drawings of increasing resolution, sweeping process_cell_size,
+epsilon and distance_threshold. For every run it records the wall time, and
+optionally the memory peak, of each step and the number of points before
+and after post-processing. Results are written as JSON and can be compared against a
+previous run to catch regressions:
+
+    python benchPipeline.py --json baseline.json
+    python benchPipeline.py --baseline baseline.json --tolerance 0.2
+
+With --memory, peaks are measured with tracemalloc, which sees NumPy buffers
+but not OpenCV's own allocations. Tracing slows the pure Python steps down
+several times over, so compare timings only between runs made with the
+same setting.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from drawPipeline import run_pipeline
+from sessionStore import DrawParams
+from armFleet import UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE  # Drawing area of the original arm
+
+SYNTHETIC_SIDES = (256, 512, 1024)
+
+
+def synthetic_image(side, seed=0):
+    """
+    Line-art test image whose content scales with the resolution.
+
+    Args:
+        side (int): Width in pixels; the height is 3/4 of it
+        seed (int): Seed for the random shapes
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    rng = np.random.default_rng(seed)
+    height = side * 3 // 4
+    image = np.full((height, side, 3), 255, np.uint8)
+    thickness = max(1, side // 256)
+    for _ in range(6):
+        center = (int(rng.uniform(0, side)), int(rng.uniform(0, height)))
+        axes = (int(rng.uniform(0.03, 0.2) * side), int(rng.uniform(0.03, 0.2) * side))
+        cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, (0, 0, 0), thickness)
+    for _ in range(3):
+        points = (rng.uniform(0, 1, (8, 2)) * (side, height)).astype(np.int32)
+        cv2.polylines(image, [points], False, (60, 60, 60), thickness)
+    cv2.putText(image, 'DrawUFPB', (side // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                side / 320, (0, 0, 0), thickness * 2)
+    return image
+
+
+def collect_images(work_dir, sides, use_assets):
+    """Return (name, path) pairs of the sample and synthetic images to benchmark."""
+    images = []
+    if use_assets:
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__) or '.', 'assets', '*_input.png'))):
+            images.append((os.path.basename(path), path))
+    for side in sides:
+        path = os.path.join(work_dir, f'synthetic_{side}.png')
+        cv2.imwrite(path, synthetic_image(side))
+        images.append((f'synthetic_{side}', path))
+    return images
+
+
+def run_case(name, path, params, output_dir, memory):
+    """Run the pipeline once and summarize its profile."""
+    profile = {}
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        points, _, _, artifacts = run_pipeline(path, output_dir, params, UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE,
+                                               profile=profile)
+    finally:
+        total = time.perf_counter() - started
+        if memory:
+            tracemalloc.stop()
+
+    height, width = artifacts['image'].shape[:2]
+    result = {
+        'image': name,
+        'width': width,
+        'height': height,
+        'params': {p: params[p] for p in ('process_cell_size', 'epsilon', 'distance_threshold', 'remove_background')},
+        'total_seconds': total,
+        'stages': profile,
+        'raw_points': len(artifacts['raw_points']),
+        'points': len(points),
+    }
+    if memory:
+        result['peak_bytes'] = max(stage.get('peak_bytes', 0) for stage in profile.values())
+    return result
+
+
+def _case_key(result):
+    return result['image'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find runs that got slower or produce a different path than the baseline.
+
+    Returns:
+        list: Human readable regression messages
+    """
+    previous = {_case_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(_case_key(result))
+        if old is None:
+            continue
+        label = f"{result['image']} {result['params']}"
+        if result['total_seconds'] > old['total_seconds'] * (1 + tolerance):
+            regressions.append(f"{label}: {old['total_seconds']:.2f}s -> {result['total_seconds']:.2f}s")
+        for stage, timing in result['stages'].items():
+            before = old['stages'].get(stage)
+            # Ignore steps too short to time reliably
+            if before and timing['seconds'] > 0.05 and timing['seconds'] > before['seconds'] * (1 + tolerance):
+                regressions.append(f"{label} [{stage}]: {before['seconds']:.2f}s -> {timing['seconds']:.2f}s")
+        if result['points'] != old['points']:
+            regressions.append(f"{label}: {old['points']} points -> {result['points']} points")
+    return regressions
+
+
+def _print_result(result):
+    stages = ' '.join(f"{stage}={timing['seconds']:.2f}" for stage, timing in result['stages'].items())
+    peak = f" peak={result['peak_bytes'] / 2 ** 20:.0f}MB" if 'peak_bytes' in result else ''
+    print(f"{result['image']:<20} {result['width']}x{result['height']} {result['params']} "
+          f"total={result['total_seconds']:.2f}s points={result['raw_points']}->{result['points']}{peak}\n    {stages}")
+
+
+def _parse_list(text, kind):
+    return [kind(value) for value in text.split(',') if value.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image-to-points pipeline.')
+    parser.add_argument('--cell-sizes', default='1,2', help='process_cell_size values to sweep')
+    parser.add_argument('--epsilons', default='1', help='epsilon values to sweep')
+    parser.add_argument('--distance-thresholds', default='3', help='distance_threshold values to sweep')
+    parser.add_argument('--sides', default=','.join(map(str, SYNTHETIC_SIDES)),
+                        help='Widths of the synthetic images, empty for none')
+    parser.add_argument('--no-assets', action='store_true', help='Skip the sample images in assets/')
+    parser.add_argument('--remove-background', action='store_true', help='Include rembg background removal')
+    parser.add_argument('--memory', action='store_true', help='Trace memory peaks (much slower)')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before flagging (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    sweep = list(itertools.product(_parse_list(args.cell_sizes, int), _parse_list(args.epsilons, float),
+                                   _parse_list(args.distance_thresholds, float)))
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench_pipeline_') as work_dir:
+        images = collect_images(work_dir, _parse_list(args.sides, int), not args.no_assets)
+        for (name, path), (cell_size, epsilon, distance_threshold) in itertools.product(images, sweep):
+            params = DrawParams(process_cell_size=cell_size, epsilon=epsilon, distance_threshold=distance_threshold,
+                                remove_background=args.remove_background).as_dict()
+            result = run_case(name, path, params, os.path.join(work_dir, 'out'), args.memory)
+            _print_result(result)
+            results.append(result)
+
+    report = {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'memory_traced': args.memory,
+            'created': time.time(),
+        },
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
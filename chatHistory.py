@@ -0,0 +1,70 @@
+import os
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Token limits for the chat history
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '3000'))          # Per prompt, system prompt included
+HISTORY_MAX_TOTAL_TOKENS = int(os.getenv('HISTORY_MAX_TOTAL_TOKENS', '500000'))  # Across every user in memory
+
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added by the chat template
+
+
+def estimate_tokens(text):
+    """Rough token count for Llama-style tokenizers (about 4 characters per token)."""
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+class ChatHistory:
+    """Chat turns per user, sharing one system prompt and trimmed to a token budget.
+
+    Older turns are dropped first, so the prompt sent to the model never grows
+    past the budget. When the history of all users together passes the total
+    cap, the least recently active users are forgotten.
+    """
+
+    def __init__(self, system_prompt, budget=HISTORY_TOKEN_BUDGET, max_total=HISTORY_MAX_TOTAL_TOKENS):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = estimate_tokens(system_prompt)
+        self.budget = budget
+        self.max_total = max_total
+        self.turns = OrderedDict()  # user_id -> deque of (message, tokens), least recently active first
+        self.tokens = {}            # user_id -> tokens held in that user's turns
+        self.total = 0
+
+    def reset(self, user_id):
+        self.total -= self.tokens.pop(user_id, 0)
+        self.turns.pop(user_id, None)
+
+    def add(self, user_id, role, content):
+        """Append a turn, then trim this user's and everyone's history to the limits."""
+        turns = self.turns.setdefault(user_id, deque())
+        self.turns.move_to_end(user_id)
+        tokens = estimate_tokens(content)
+        turns.append(({"role": role, "content": content}, tokens))
+        self.tokens[user_id] = self.tokens.get(user_id, 0) + tokens
+        self.total += tokens
+
+        # Keep the newest turns that fit next to the system prompt, but never drop the latest one
+        while len(turns) > 1 and self.system_tokens + self.tokens[user_id] > self.budget:
+            self._drop_oldest(user_id)
+        # A conversation sent to the model should start with the user speaking
+        while len(turns) > 1 and turns[0][0]["role"] != "user":
+            self._drop_oldest(user_id)
+
+        while self.total > self.max_total and len(self.turns) > 1:
+            oldest = next(iter(self.turns))
+            if oldest == user_id:
+                break
+            self.reset(oldest)
+
+    def _drop_oldest(self, user_id):
+        _, tokens = self.turns[user_id].popleft()
+        self.tokens[user_id] -= tokens
+        self.total -= tokens
+
+    def messages(self, user_id):
+        """Messages to send to the model: the system prompt followed by the kept turns."""
+        return [self.system_message] + [message for message, _ in self.turns.get(user_id, ())]
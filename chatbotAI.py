@@ -1,13 +1,25 @@
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+STARTED = time.perf_counter()  # Before the imports, so startup time includes them
+import asyncio
+import logging
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
 from dotenv import load_dotenv
-import requests
-from groq import Groq
+from groq import AsyncGroq
 from io import BytesIO
-from AmericoDraws import independencia_ou_morte
-from plcBridge import makeDraw  # Import from bot.py
-from huggingface_hub import InferenceClient
+from drawPipeline import run_pipeline_profiled, quick_preview, first_stale_stage, warm_up, fetch_background_model, WARMUP_REMBG, OUTPUT_SETTINGS
+from drawScheduler import DrawScheduler
+from armFleet import ArmFleet
+from drawEstimator import DrawEstimator
+from drawWorkers import ProcessingPool, QueueFullError, JobCancelledError, PROCESS_WARMUP
+from drawJobs import JobStore
+from drawCache import DrawCache
+from fluxClient import FluxClient, ImageGenerationError
+from chatHistory import ChatHistory
+from sessionStore import SessionStore
+from updateProcessor import PerUserUpdateProcessor
+from metrics import Gauge, Histogram, MetricsExporter, event, setup_logging, track_api, track_handler
 
 # Load environment variables
 load_dotenv()
@@ -16,36 +28,78 @@ load_dotenv()
 TOKEN_TELEGRAM = os.getenv('TOKEN_TELEGRAM')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 HUGGINGFACE_API_KEY= os.getenv('HUGGINGFACE_API_KEY')
+
+# Webhook mode, used instead of polling when WEBHOOK_URL (the public base URL) is set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None  # Checked against Telegram's secret token header
 # Initialize Groq client
-groq_client = Groq(api_key=GROQ_API_KEY)
+groq_client = AsyncGroq(api_key=GROQ_API_KEY)
+# Pooled async client for FLUX image generation
+flux_client = FluxClient(api_key=HUGGINGFACE_API_KEY)
+# Worker processes for image processing, each loading the heavy models as it starts
+processing_pool = ProcessingPool(initializer=warm_up)
+# Drawing time model, calibrated from finished drawings
+draw_estimator = DrawEstimator()
+# Arms listed in ARM_FLEET, or the single arm at CLP_IP
+fleet = ArmFleet()
+# Queue of confirmed drawings in front of the robotic arms
+scheduler = DrawScheduler(fleet, estimator=draw_estimator)
+# Processed drawings keyed by image content and parameters
+draw_cache = DrawCache()
+
+# Updates of different users are handled concurrently, each user's in order
+updates = PerUserUpdateProcessor()
+
+# Runtime metrics, served or dumped as configured by METRICS_PORT / METRICS_FILE
+log = logging.getLogger('chatbotAI')
+metrics_exporter = MetricsExporter()
+PIPELINE_STEP_SECONDS = Histogram('pipeline_step_seconds', 'Time spent in each image processing step', ('step',))
+Gauge('draw_queue_depth', 'Drawings waiting for an arm', function=lambda: len(scheduler.queue))
+Gauge('arm_healthy', 'Whether the arm answers (1) or is offline (0)', ('arm',),
+      function=lambda: {(arm.name,): int(arm.healthy) for arm in fleet.arms})
+Gauge('arm_busy', 'Whether the arm is drawing right now', ('arm',),
+      function=lambda: {(arm.name,): int(not arm.idle) for arm in fleet.arms})
+Gauge('arm_utilization', 'Fraction of the time since startup the arm spent drawing', ('arm',),
+      function=lambda: {(arm.name,): arm.utilization() for arm in fleet.arms})
+Gauge('arm_drawings', 'Drawings finished or failed on the arm since startup', ('arm', 'result'),
+      function=lambda: {key: value for arm in fleet.arms
+                        for key, value in (((arm.name, 'ok'), arm.completed), ((arm.name, 'failed'), arm.failed))})
+Gauge('processing_jobs', 'Images being processed or waiting for a worker', function=lambda: processing_pool.depth)
+Gauge('bot_updates_in_flight', 'Updates being handled', function=lambda: updates.running)
+Gauge('bot_updates_pending', 'Updates waiting for their turn', function=lambda: updates.pending)
+STARTUP_SECONDS = Gauge('bot_startup_seconds', 'Time from process start until the bot was ready to poll')
+WORKERS_READY_SECONDS = Gauge('processing_workers_ready_seconds', 'Time the processing workers took to start and warm up')
+FIRST_JOB_SECONDS = Gauge('first_job_seconds', 'Processing time of the first image job since startup')
+first_job_done = False
 
 # Define conversation states
 CHATTING, GENERATING_IMAGE, DRAWING_CONFIRM, UPLOAD_PHOTO, EDITING_PARAMS, WAITING_PARAM_VALUE = range(6)
 
-# Store conversation history for each user
-user_conversations = {}
-# Store points for drawing
-points = []
-# Store generated image path for current session
-current_image_path = None
-# Store user-specific parameters
-user_params = {}
-
-# Default parameters for drawing
-DEFAULT_PARAMS = {
-    'process_cell_size': 1,
-    'points_cell_width': 1,
-    'z_up': -10,
-    'remove_background': False,  # New parameter
-    'bg_threshold': 10,
-    'bg_erode_pixels': 1,
-    'threshold1': 50,
-    'threshold2': 191,
-    'blur_size': 3,
-    'distance_threshold': 3,
-    'epsilon': 1,
-    'linewidth': 5
-}
+# System prompt shared by every conversation
+SYSTEM_PROMPT = """You are a friendly and knowledgeable assistant designed to help users create drawings using a robotic arm. Your mission is to guide them step-by-step—from generating creative images to transforming them into real-world sketches using the robot. 🎨 How to Interact with Me: Just send a message to start a conversation. Want to turn your imagination into art? Use the /image command followed by a description. Example: /image a cat wearing sunglasses. After generating your image, I'll ask if you'd like to draw it with the robotic arm. 📚 Available Commands: /start – Start or restart the conversation. /image – Generate an image from a description. /help – Show this help message. /clear – Clear the conversation history. /cancel – Cancel the current operation. /upload - Upload your own photo for drawing. /params - View and edit drawing parameters. Let's make something amazing together! 🤖🖋️"""
+
+# Store conversation history for each user, trimmed to a token budget
+user_conversations = ChatHistory(SYSTEM_PROMPT)
+# Store each user's current drawing job (image, workspace and points)
+jobs = JobStore()
+
+def forget_user(user_id):
+    """Drop what an evicted user leaves in memory and on disk, besides their saved parameters."""
+    user_conversations.reset(user_id)
+    jobs.drop(user_id)
+
+# Store user-specific parameters, forgetting idle users' chat history and drawing job along with them
+sessions = SessionStore(on_evict=forget_user)
+
+# Drawings are planned in the first arm's drawing area and remapped for the others
+UPPER_LEFT_EDGE = fleet.reference.upper_left_edge
+BOTTOM_RIGHT_EDGE = fleet.reference.bottom_right_edge
+
+# Parameters edited as 1 (yes) / 0 (no)
+BOOLEAN_PARAMS = {'remove_background', 'optimize_path', 'simplify_path', 'quick_preview'}
 
 # Add to EDITABLE_PARAMS list
 EDITABLE_PARAMS = [
@@ -60,20 +114,141 @@ EDITABLE_PARAMS = [
     ('blur_size', 'Blur size for edge detection'),
     ('distance_threshold', 'Min distance between points'),
     ('epsilon', 'Simplification factor for lines'),
-    ('linewidth', 'Width of drawn lines')
+    ('linewidth', 'Width of drawn lines'),
+    ('optimize_path', 'Reorder strokes to reduce pen-up travel (1=yes, 0=no)'),
+    ('simplify_path', 'Merge redundant and collinear points (1=yes, 0=no)'),
+    ('quick_preview', 'Fast low-resolution preview, full path computed on confirm (1=yes, 0=no)')
 ]
 
+async def process_image(job, params, full=False):
+    """Run the drawing pipeline for the job in the worker pool, reusing cached results.
+
+    With quick_preview on, only a rough low-resolution preview is made and the
+    points are left for later, unless full is set.
+
+    Returns the first stage that was recomputed, 'quick' for a quick preview,
+    or None on a cache hit.
+    """
+    global first_job_done
+    if not first_job_done:
+        first_job_done = True
+        started = time.perf_counter()
+        try:
+            return await process_image(job, params, full)
+        finally:
+            seconds = time.perf_counter() - started
+            FIRST_JOB_SECONDS.set(seconds)
+            event(log, 'first_job', seconds=f'{seconds:.2f}', since_start=f'{time.perf_counter() - STARTED:.1f}')
+
+    if params['remove_background']:
+        # Download the model here, once, rather than in every worker at the same time
+        await asyncio.to_thread(fetch_background_model)
+
+    if params['quick_preview'] and not full:
+        with PIPELINE_STEP_SECONDS.time(step='quick_preview'):
+            job.previews = await processing_pool.run(
+                job.user_id,
+                quick_preview,
+                input_path=job.image_path,
+                params=dict(params),
+                upper_left_edge=UPPER_LEFT_EDGE,
+                bottom_right_edge=BOTTOM_RIGHT_EDGE
+            )
+        job.points = []
+        job.reports = {}
+        job.params = dict(params)
+        job.quick = True
+        return 'quick'
+
+    # The full result does not depend on how it was previewed
+    pipeline_params = dict(params, quick_preview=False)
+    key = draw_cache.key(job.image_path, pipeline_params, UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE, OUTPUT_SETTINGS)
+    if draw_cache.load(key, job):
+        job.params = dict(params)
+        job.quick = False
+        return None
+
+    # Reuse the stages of the previous run that this parameter set leaves untouched
+    start = 'background'
+    if job.artifacts:
+        start = first_stale_stage(job.artifact_params, pipeline_params) or 'preview'
+
+    (job.points, job.reports, job.previews, job.artifacts), profile = await processing_pool.run(
+        job.user_id,
+        run_pipeline_profiled,
+        input_path=job.image_path,
+        output_dir=job.workspace,
+        params=pipeline_params,
+        upper_left_edge=UPPER_LEFT_EDGE,
+        bottom_right_edge=BOTTOM_RIGHT_EDGE,
+        artifacts=job.artifacts,
+        start=start
+    )
+    for step, timing in profile.items():
+        PIPELINE_STEP_SECONDS.observe(timing['seconds'], step=step)
+    job.params = dict(params)
+    job.artifact_params = pipeline_params
+    job.quick = False
+    draw_cache.store(key, job)
+    return start
+
+async def send_previews(message, job):
+    """Send the job's previews as a single album."""
+    await message.reply_media_group([InputMediaPhoto(BytesIO(data)) for data in job.previews.values()])
+
+def describe_drawing(job):
+    """Ask to draw the previewed job, saying how long it is when the points are known."""
+    if job.quick:
+        return (
+            "Would you like to draw this with the robotic arm? (yes/no)\n"
+            "This is a quick preview: the full-quality path will be computed when you say yes."
+        )
+    return (
+        f"Would you like to draw this with the robotic arm? It will take {len(job.points)} movements. (yes/no)"
+        f"{describe_estimate(job.points)}{describe_reports(job.reports)}"
+    )
+
+def describe_estimate(points):
+    """Summarize the predicted drawing time for the user."""
+    estimate = draw_estimator.estimate(points)
+    return (
+        f"\nEstimated drawing time: {format_duration(estimate['total'])} "
+        f"({format_duration(estimate['pen_down'])} drawing, {format_duration(estimate['pen_up'])} moving between strokes, "
+        f"{estimate['pen_down_travel'] + estimate['pen_up_travel']:.0f} mm of travel)."
+    )
+
+def describe_reports(reports):
+    """Summarize the path post-processing reports for the user."""
+    lines = []
+    simplify = reports.get('simplify')
+    if simplify and simplify['points_after'] < simplify['points_before']:
+        lines.append(f"Redundant points merged: {simplify['points_before']} → {simplify['points_after']} movements.")
+    order = reports.get('stroke_order')
+    if order and order['travel_after'] < order['travel_before']:
+        lines.append(
+            f"Pen-up travel cut from {order['travel_before']:.0f} mm to {order['travel_after']:.0f} mm "
+            f"and lifts from {order['lifts_before']} to {order['lifts_after']} "
+            f"(~{format_duration(order['time_saved'])} saved)."
+        )
+    return "".join(f"\n{line}" for line in lines)
+
+def format_duration(seconds):
+    """Format a duration in seconds as a short human readable string."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}min"
+    if minutes:
+        return f"{minutes}min {seconds:02d}s"
+    return f"{seconds}s"
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the conversation and initialize user context."""
     user_id = update.effective_user.id
-    user_conversations[user_id] = [{
-            "role": "system",
-            "content": """You are a friendly and knowledgeable assistant designed to help users create drawings using a robotic arm. Your mission is to guide them step-by-step—from generating creative images to transforming them into real-world sketches using the robot. 🎨 How to Interact with Me: Just send a message to start a conversation. Want to turn your imagination into art? Use the /image command followed by a description. Example: /image a cat wearing sunglasses. After generating your image, I'll ask if you'd like to draw it with the robotic arm. 📚 Available Commands: /start – Start or restart the conversation. /image – Generate an image from a description. /help – Show this help message. /clear – Clear the conversation history. /cancel – Cancel the current operation. /upload - Upload your own photo for drawing. /params - View and edit drawing parameters. Let's make something amazing together! 🤖🖋️"""
-        }]
+    user_conversations.reset(user_id)
     
-    # Initialize user parameters
-    if user_id not in user_params:
-        user_params[user_id] = DEFAULT_PARAMS.copy()
+    # Load user parameters
+    sessions.params(user_id)
  
     welcome_message = (
         "👋 Hello! I'm an AI assistant that can help you make drawings with the robotic arm!\n\n"
@@ -88,6 +263,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/image - Generate an image\n"
         "/upload - Upload your own photo\n"
         "/params - View and edit drawing parameters\n"
+        "/reprocess - Reprocess your last image with the current parameters\n"
+        "/queue - Show the drawing queue\n"
+        "/dequeue - Remove your drawings from the queue\n"
         "/help - Show this help message\n"
         "/clear - Clear your conversation history\n"
         "/cancel - Cancel current operation"
@@ -104,6 +282,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/image - Generate an image\n"
         "/upload - Upload your own photo\n"
         "/params - View and edit drawing parameters\n"
+        "/reprocess - Reprocess your last image with the current parameters\n"
+        "/queue - Show the drawing queue\n"
+        "/dequeue - Remove your drawings from the queue\n"
         "/help - Show this help message\n"
         "/clear - Clear your conversation history\n"
         "/cancel - Cancel current operation\n\n"
@@ -117,46 +298,39 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clear the conversation history for the user."""
     user_id = update.effective_user.id
-    user_conversations[user_id] = [{
-            "role": "system",
-            "content": """You are a friendly and knowledgeable assistant designed to help users create drawings using a robotic arm. Your mission is to guide them step-by-step—from generating creative images to transforming them into real-world sketches using the robot. 🎨 How to Interact with Me: Just send a message to start a conversation. Want to turn your imagination into art? Use the /image command followed by a description. Example: /image a cat wearing sunglasses. After generating your image, I'll ask if you'd like to draw it with the robotic arm. 📚 Available Commands: /start – Start or restart the conversation. /image – Generate an image from a description. /help – Show this help message. /clear – Clear the conversation history. /cancel – Cancel the current operation. /upload - Upload your own photo for drawing. /params - View and edit drawing parameters. Let's make something amazing together! 🤖🖋️"""
-        }]
+    user_conversations.reset(user_id)
     
     await update.message.reply_text("Conversation history cleared! Let's start fresh.")
     return CHATTING
 
+@track_handler
 async def chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user messages and generate AI responses."""
     user_id = update.effective_user.id
     user_message = update.message.text
     
-    # Initialize user conversation history if not exists
-    if user_id not in user_conversations:
-        user_conversations[user_id] = [{
-            "role": "system",
-            "content": """You are a friendly and knowledgeable assistant designed to help users create drawings using a robotic arm. Your mission is to guide them step-by-step—from generating creative images to transforming them into real-world sketches using the robot. 🎨 How to Interact with Me: Just send a message to start a conversation. Want to turn your imagination into art? Use the /image command followed by a description. Example: /image a cat wearing sunglasses. After generating your image, I'll ask if you'd like to draw it with the robotic arm. 📚 Available Commands: /start – Start or restart the conversation. /image – Generate an image from a description. /help – Show this help message. /clear – Clear the conversation history. /cancel – Cancel the current operation. /upload - Upload your own photo for drawing. /params - View and edit drawing parameters. Let's make something amazing together! 🤖🖋️"""
-        }]
-    
     # Add user message to history
-    user_conversations[user_id].append({"role": "user", "content": user_message}) 
+    sessions.touch(user_id)
+    user_conversations.add(user_id, "user", user_message)
     
     # Show typing indicator
     await update.message.chat.send_action(action="typing")
     
     try:
         # Geet AI response from Groq
-        response = groq_client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=user_conversations[user_id],
-            max_tokens=1024,
-            temperature=0.7,
-            top_p=0.9
-        )
+        with track_api('groq'):
+            response = await groq_client.chat.completions.create(
+                model="llama-3.1-8b-instant",
+                messages=user_conversations.messages(user_id),
+                max_tokens=1024,
+                temperature=0.7,
+                top_p=0.9
+            )
         
         assistant_message = response.choices[0].message.content
         
         # Add assistant response to history
-        user_conversations[user_id].append({"role": "assistant", "content": assistant_message})
+        user_conversations.add(user_id, "assistant", assistant_message)
         
         # Send response to user
         await update.message.reply_text(assistant_message)
@@ -171,101 +345,61 @@ async def image_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Please describe the image you want me to generate:")
     return GENERATING_IMAGE
 
+@track_handler
 async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate an image based on user prompt using Hugging Face FLUX.1-dev model."""
-    global current_image_path
-    global points
-    
     user_id = update.effective_user.id
     prompt = update.message.text
     
-    # Make sure user parameters are initialized
-    if user_id not in user_params:
-        user_params[user_id] = DEFAULT_PARAMS.copy()
+    # Keep the user's session active
+    sessions.touch(user_id)
 
     await update.message.reply_text(f"Generating image for: '{prompt}'... This might take a moment.")
     await update.message.chat.send_action(action="upload_photo")
 
     try:
-        # Using Hugging Face FLUX.1-dev model
-        API_URL = "https://router.huggingface.co/hf-inference/models/black-forest-labs/FLUX.1-dev"
-        headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
-
-        payload = {
-            "inputs": prompt,
-        }
-
-        # Make request to Hugging Face API
-        response = requests.post(API_URL, headers=headers, json=payload)
-
-        if response.status_code == 200:
-            # Ensure steps directory exists
-            os.makedirs('steps', exist_ok=True)
-
-            # Save the image to file
-            current_image_path = 'steps/input.png'
-            with open(current_image_path, 'wb') as f:
-                f.write(response.content)
-
-            # Send the image
-            await update.message.reply_photo(photo=open(current_image_path, 'rb'))
-            await update.message.reply_text(f"Processing this result...This is usually fast.")
-            
-            # Get user-specific parameters
-            params = user_params[user_id]
-            
-            # Process image for drawing with user parameters
-            points = independencia_ou_morte(
-                input_path=current_image_path,
-                output_dir="steps",
-                process_cell_size=params['process_cell_size'],
-                points_cell_width=params['points_cell_width'],
-                upper_left_edge=[170, 65, -118, -3, 88, -2],
-                bottom_right_edge=[601, 403, -118, -3, 88, -2],
-                z_up=params['z_up'],
-                remove_background=params['remove_background'],  # Use the parameter value
-                # Background removal parameters
-                bg_threshold=params['bg_threshold'],
-                bg_erode_pixels=params['bg_erode_pixels'],
-                # Contour extraction parameters
-                threshold1=params['threshold1'],
-                threshold2=params['threshold2'],
-                blur_size=params['blur_size'],
-                # Path optimization parameters
-                distance_threshold=params['distance_threshold'],
-                epsilon=params['epsilon'],
-                linewidth=params['linewidth']
-            )
+        # Generate the image with the Hugging Face FLUX.1-dev model
+        image_bytes = await flux_client.generate(prompt)
 
-            # Send processed image preview
-            if os.path.exists('steps/final_result.png'):
-                await update.message.reply_photo(photo=open('steps/contour.png', 'rb'))
-                await update.message.reply_photo(photo=open('steps/3d_path.png', 'rb'))
-                await update.message.reply_photo(photo=open('steps/final_result.png', 'rb'))
-                await update.message.reply_text(
-                    f"Here's your generated image and how it would look when drawn! "
-                    f"Would you like to draw this with the robotic arm? It will take {len(points)} movements. (yes/no)"
-                )
-                return DRAWING_CONFIRM
-            else:
-                await update.message.reply_text(
-                    "Image generated successfully, but I couldn't create a drawing preview. "
-                    "Would you like to try drawing it anyway? (yes/no)"
-                )
-                return DRAWING_CONFIRM
+        # Start a new job with its own workspace
+        job = jobs.new(user_id)
 
-        else:
-            error_message = f"API Error: {response.status_code}"
-            try:
-                error_data = response.json()
-                if "error" in error_data:
-                    error_message = f"Image generation failed: {error_data['error']}"
-            except:
-                pass
+        # Save the image to file
+        with open(job.image_path, 'wb') as f:
+            f.write(image_bytes)
 
-            await update.message.reply_text(error_message)
-            return CHATTING
+        # Send the image
+        await update.message.reply_photo(photo=image_bytes)
+        await update.message.reply_text(f"Processing this result...This is usually fast.")
+        
+        # Get user-specific parameters
+        params = sessions.params(user_id).as_dict()
+        
+        # Process image for drawing with user parameters
+        await process_image(job, params)
 
+        # Send processed image preview
+        if 'final_result' in job.previews:
+            await send_previews(update.message, job)
+            await update.message.reply_text(
+                f"Here's your generated image and how it would look when drawn! {describe_drawing(job)}"
+            )
+            return DRAWING_CONFIRM
+        else:
+            await update.message.reply_text(
+                "Image generated successfully, but I couldn't create a drawing preview. "
+                "Would you like to try drawing it anyway? (yes/no)"
+            )
+            return DRAWING_CONFIRM
+
+    except ImageGenerationError as e:
+        await update.message.reply_text(str(e))
+        return CHATTING
+    except JobCancelledError:
+        return CHATTING
+    except (QueueFullError, TimeoutError) as e:
+        await update.message.reply_text(str(e))
+        return CHATTING
     except Exception as e:
         await update.message.reply_text(f"Sorry, I encountered an error generating the image: {str(e)}")
         return CHATTING
@@ -278,11 +412,9 @@ async def upload_photo_command(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     return UPLOAD_PHOTO
 
+@track_handler
 async def process_uploaded_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process a photo uploaded by the user."""
-    global current_image_path
-    global points
-    
     user_id = update.effective_user.id
     
     # Ensure the message contains a photo
@@ -300,49 +432,23 @@ async def process_uploaded_photo(update: Update, context: ContextTypes.DEFAULT_T
         # Get the file from Telegram
         file = await context.bot.get_file(photo.file_id)
         
-        # Ensure steps directory exists
-        os.makedirs('steps', exist_ok=True)
-        
-        # Set the file path
-        current_image_path = 'steps/input.png'
+        # Start a new job with its own workspace
+        job = jobs.new(user_id)
         
         # Download the file
-        await file.download_to_drive(current_image_path)
+        await file.download_to_drive(job.image_path)
         
         # Get user-specific parameters
-        params = user_params[user_id]
+        params = sessions.params(user_id).as_dict()
         
         # Process image for drawing with user parameters
-        points = independencia_ou_morte(
-            input_path=current_image_path,
-            output_dir="steps",
-            process_cell_size=params['process_cell_size'],
-            points_cell_width=params['points_cell_width'],
-            upper_left_edge=[170, 65, -118, -3, 88, -2],
-            bottom_right_edge=[601, 403, -118, -3, 88, -2],
-            z_up=params['z_up'],
-            remove_background=params['remove_background'],  # Use the parameter value
-            # Background removal parameters
-            bg_threshold=params['bg_threshold'],
-            bg_erode_pixels=params['bg_erode_pixels'],
-            # Contour extraction parameters
-            threshold1=params['threshold1'],
-            threshold2=params['threshold2'],
-            blur_size=params['blur_size'],
-            # Path optimization parameters
-            distance_threshold=params['distance_threshold'],
-            epsilon=params['epsilon'],
-            linewidth=params['linewidth']
-        )
+        await process_image(job, params)
         
         # Send processed image preview
-        if os.path.exists('steps/final_result.png'):
-            await update.message.reply_photo(photo=open('steps/contour.png', 'rb'))
-            await update.message.reply_photo(photo=open('steps/3d_path.png', 'rb'))
-            await update.message.reply_photo(photo=open('steps/final_result.png', 'rb'))
+        if 'final_result' in job.previews:
+            await send_previews(update.message, job)
             await update.message.reply_text(
-                f"Here's how your photo would look when drawn! "
-                f"Would you like to draw this with the robotic arm? It will take {len(points)} movements. (yes/no)"
+                f"Here's how your photo would look when drawn! {describe_drawing(job)}"
             )
         else:
             await update.message.reply_text(
@@ -352,25 +458,73 @@ async def process_uploaded_photo(update: Update, context: ContextTypes.DEFAULT_T
         
         return DRAWING_CONFIRM
         
+    except JobCancelledError:
+        return CHATTING
+    except (QueueFullError, TimeoutError) as e:
+        await update.message.reply_text(str(e))
+        return CHATTING
     except Exception as e:
         await update.message.reply_text(f"Sorry, I encountered an error processing your photo: {str(e)}")
         return CHATTING
 
+@track_handler
 async def draw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle confirmation for drawing the generated image."""
-    global points
-    
+    user_id = update.effective_user.id
     user_response = update.message.text.lower()
+    job = jobs.get(user_id)
     
     if user_response == "yes":
-        await update.message.reply_text("Starting the drawing process... I'll be back when the drawing is done!")
-        
-        try:
-            # Draw using the robotic arm
-            await makeDraw(points)
-            await update.message.reply_text("Drawing completed successfully! What would you like to do next?")
-        except Exception as e:
-            await update.message.reply_text(f"Sorry, I encountered an error while drawing: {str(e)}")
+        if job is None or not (job.points or job.quick):
+            await update.message.reply_text("There is nothing to draw yet. Use /image or /upload first.")
+            return CHATTING
+
+        if scheduler.find(job.job_id) is not None:
+            await update.message.reply_text(
+                f"Job {job.job_id} is already in the queue as you confirmed it. "
+                "Use /dequeue first if you want to draw the new version instead."
+            )
+            return CHATTING
+
+        if job.quick:
+            # Compute the full-quality path for the previewed parameters
+            await update.message.reply_text("Computing the full-quality path for your drawing...")
+            await update.message.chat.send_action(action="typing")
+            try:
+                await process_image(job, job.params, full=True)
+            except JobCancelledError:
+                return CHATTING
+            except (QueueFullError, TimeoutError) as e:
+                await update.message.reply_text(str(e))
+                return CHATTING
+            except Exception as e:
+                await update.message.reply_text(f"Sorry, I encountered an error processing your image: {str(e)}")
+                return CHATTING
+
+            if not job.points:
+                await update.message.reply_text("I couldn't find anything to draw in this image at full quality.")
+                return CHATTING
+            await update.message.reply_text(
+                f"The full path is ready: {len(job.points)} movements."
+                f"{describe_estimate(job.points)}{describe_reports(job.reports)}"
+            )
+
+        chat_id = update.effective_chat.id
+
+        async def notify(text):
+            await context.bot.send_message(chat_id=chat_id, text=text)
+
+        # Queue the drawing for the robotic arm
+        position = scheduler.submit(job, notify)
+        if position is None:
+            await update.message.reply_text(f"Job {job.job_id} is already in the queue.")
+            return CHATTING
+        eta = scheduler.eta(job.job_id)
+        await update.message.reply_text(
+            f"Your drawing is #{position} in the queue (job {job.job_id}). "
+            f"Estimated start in {format_duration(eta)}. I'll let you know when it starts and finishes!\n"
+            "Use /queue to check the queue or /dequeue to give up your spot."
+        )
     else:
         await update.message.reply_text("No problem! The image won't be drawn. What would you like to do next?")
     
@@ -378,23 +532,107 @@ async def draw_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the current operation."""
+    # Stop any image processing still running for this user
+    processing_pool.cancel(update.effective_user.id)
     await update.message.reply_text("Current operation cancelled. What would you like to do?")
     return CHATTING
 
+async def still_working(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer messages sent while the user's image is still being generated or processed."""
+    if update.message is not None:
+        await update.message.reply_text("I'm still working on your image. Use /cancel to stop it.")
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the drawing queue with positions and estimated start times."""
+    user_id = update.effective_user.id
+    lines = []
+
+    for arm in fleet.arms:
+        owner = " (yours)" if arm.current is not None and arm.current.job.user_id == user_id else ""
+        lines.append(f"🤖 {arm.name}: {arm.status()}{owner}, busy {arm.utilization():.0%} of the time")
+
+    for position, entry in scheduler.list():
+        owner = " (yours)" if entry.job.user_id == user_id else ""
+        eta = format_duration(scheduler.eta(entry.job.job_id))
+        lines.append(f"#{position}: job {entry.job.job_id}, {len(entry.points)} movements, starts in ~{eta}{owner}")
+
+    if not scheduler.queue:
+        lines.append("The drawing queue is empty.")
+
+    await update.message.reply_text("\n".join(lines))
+    return CHATTING
+
+async def dequeue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove the user's drawings from the queue."""
+    removed = scheduler.cancel(update.effective_user.id)
+    if removed:
+        await update.message.reply_text(f"Removed {removed} drawing(s) from the queue.")
+    else:
+        await update.message.reply_text("You have no drawings waiting in the queue.")
+    return CHATTING
+
+@track_handler
+async def reprocess_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reprocess the last image with the current parameters, recomputing only what changed."""
+    user_id = update.effective_user.id
+    job = jobs.get(user_id)
+
+    if job is None or not os.path.exists(job.image_path):
+        await update.message.reply_text("There is no image to reprocess yet. Use /image or /upload first.")
+        return CHATTING
+
+    params = sessions.params(user_id).as_dict()
+    if job.params == params:
+        await update.message.reply_text("Your parameters haven't changed since the last preview. Use /params to edit them.")
+        return CHATTING
+
+    await update.message.reply_text("Reprocessing your last image with the new parameters...")
+    await update.message.chat.send_action(action="typing")
+
+    try:
+        started = time.perf_counter()
+        stage = await process_image(job, params)
+        elapsed = time.perf_counter() - started
+    except JobCancelledError:
+        return CHATTING
+    except (QueueFullError, TimeoutError) as e:
+        await update.message.reply_text(str(e))
+        return CHATTING
+    except Exception as e:
+        await update.message.reply_text(f"Sorry, I encountered an error reprocessing your image: {str(e)}")
+        return CHATTING
+
+    if 'final_result' not in job.previews:
+        await update.message.reply_text(
+            "Image reprocessed, but I couldn't create a drawing preview. "
+            "Would you like to try drawing it anyway? (yes/no)"
+        )
+        return DRAWING_CONFIRM
+
+    if stage is None:
+        source = "from cache"
+    elif stage == 'quick':
+        source = "as a quick preview"
+    else:
+        source = f"from the {stage} stage"
+    await send_previews(update.message, job)
+    await update.message.reply_text(
+        f"Updated {source} in {elapsed:.1f}s. {describe_drawing(job)}"
+    )
+    return DRAWING_CONFIRM
+
 # New functions for parameter editing
 
 async def params_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display current parameters and allow editing."""
     user_id = update.effective_user.id
     
-    # Initialize parameters if not existing
-    if user_id not in user_params:
-        user_params[user_id] = DEFAULT_PARAMS.copy()
+    params = sessions.params(user_id)
     
     # Create keyboard with parameter options
     keyboard = []
     for param_name, param_desc in EDITABLE_PARAMS:
-        current_value = user_params[user_id][param_name]
+        current_value = getattr(params, param_name)
         keyboard.append([InlineKeyboardButton(
             f"{param_name}: {current_value} - {param_desc}", 
             callback_data=f"edit_{param_name}"
@@ -424,7 +662,7 @@ async def param_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if data == "reset_params":
         # Reset to default values
-        user_params[user_id] = DEFAULT_PARAMS.copy()
+        sessions.reset(user_id)
         
         await query.edit_message_text(
             "Parameters reset to default values. Use /params to view them."
@@ -433,11 +671,11 @@ async def param_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data.startswith("edit_"):
         # Extract parameter name
-        param_name = data.split("_")[1]
+        param_name = data[len("edit_"):]
         
         # Find parameter description
         param_desc = next((desc for name, desc in EDITABLE_PARAMS if name == param_name), "")
-        current_value = user_params[user_id][param_name]
+        current_value = getattr(sessions.params(user_id), param_name)
         
         await query.edit_message_text(
             f"Editing parameter: {param_name}\n"
@@ -468,19 +706,20 @@ async def save_param_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Convert to integer
         new_value = int(text)
         
-        # Special handling for remove_background parameter
-        if param_name == 'remove_background':
+        # Special handling for yes/no parameters
+        if param_name in BOOLEAN_PARAMS:
             if new_value not in [0, 1]:
-                await update.message.reply_text("❌ For remove_background, please enter 1 (yes) or 0 (no).")
+                await update.message.reply_text(f"❌ For {param_name}, please enter 1 (yes) or 0 (no).")
                 return WAITING_PARAM_VALUE
             new_value = bool(new_value)  # Convert to boolean
         
         # Update the parameter
-        user_params[user_id][param_name] = new_value
+        setattr(sessions.params(user_id), param_name, new_value)
+        sessions.save(user_id)
         
         await update.message.reply_text(
             f"✅ Parameter '{param_name}' updated to {new_value}.\n\n"
-            f"Use /params to view or edit other parameters."
+            f"Use /params to view or edit other parameters, or /reprocess to apply them to your last image."
         )
         
     except ValueError:
@@ -492,10 +731,55 @@ async def save_param_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return CHATTING
 
-def main():
-    """Run the bot."""
-    # Create the Application
-    application = Application.builder().token(TOKEN_TELEGRAM).build()
+async def warm_up_workers():
+    """Start the processing workers in the background so the first job finds them ready."""
+    if WARMUP_REMBG:
+        # Workers load the model as they start; fetch it first so they don't all download it
+        try:
+            await asyncio.to_thread(fetch_background_model)
+        except Exception as e:
+            log.warning("Could not download the background removal model: %s", e)
+    try:
+        seconds = await processing_pool.start()
+    except Exception as e:
+        log.warning("Could not start the processing workers early: %s", e)
+        return
+    WORKERS_READY_SECONDS.set(seconds)
+    event(log, 'workers_ready', workers=processing_pool.workers, seconds=f'{seconds:.2f}')
+
+async def start_scheduler(application):
+    """Start the robotic arm worker, the metrics exporter and the processing workers' warm-up."""
+    scheduler.start()
+    await metrics_exporter.start()
+    if PROCESS_WARMUP:
+        application.create_task(warm_up_workers())
+    seconds = time.perf_counter() - STARTED
+    STARTUP_SECONDS.set(seconds)
+    event(log, 'startup', seconds=f'{seconds:.2f}')
+
+async def shutdown_workers(application):
+    """Stop the arm worker, the image processing workers, the HTTP client, the session store and the metrics exporter."""
+    await scheduler.stop()
+    processing_pool.shutdown()
+    await flux_client.close()
+    sessions.close()
+    await metrics_exporter.stop()
+
+def build_application(bot=None, update_processor=None):
+    """Create the Application with every handler registered.
+
+    Args:
+        bot: Bot to use instead of one built from TOKEN_TELEGRAM (see loadTest.py)
+        update_processor: Replaces the default per-user concurrent update processing
+    """
+    builder = (
+        Application.builder()
+        .post_init(start_scheduler)
+        .post_shutdown(shutdown_workers)
+        .concurrent_updates(update_processor or updates)
+    )
+    builder = builder.bot(bot) if bot is not None else builder.token(TOKEN_TELEGRAM)
+    application = builder.build()
 
     # Set up the ConversationHandler
     conv_handler = ConversationHandler(
@@ -506,22 +790,25 @@ def main():
                 CommandHandler("image", image_command),
                 CommandHandler("upload", upload_photo_command),
                 CommandHandler("params", params_command),  # New command for parameters
+                CommandHandler("reprocess", reprocess_command, block=False),
                 CommandHandler("clear", clear_history),
+                CommandHandler("queue", queue_command),
+                CommandHandler("dequeue", dequeue_command),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, chat),
             ],
             GENERATING_IMAGE: [
                 CommandHandler("cancel", cancel),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, generate_image),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, generate_image, block=False),
             ],
             UPLOAD_PHOTO: [
                 CommandHandler("cancel", cancel),
-                MessageHandler(filters.PHOTO, process_uploaded_photo),
+                MessageHandler(filters.PHOTO, process_uploaded_photo, block=False),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, lambda update, context: 
                     update.message.reply_text("Please upload a photo or use /cancel to go back.")),
             ],
             DRAWING_CONFIRM: [
                 CommandHandler("cancel", cancel),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, draw_confirm),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, draw_confirm, block=False),
             ],
             EDITING_PARAMS: [
                 CommandHandler("cancel", cancel),
@@ -531,15 +818,39 @@ def main():
                 CommandHandler("cancel", cancel),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, save_param_value),
             ],
+            # While a non-blocking handler (block=False above) is still running, the
+            # conversation only checks these; the state that handler returns still wins
+            ConversationHandler.WAITING: [
+                CommandHandler("cancel", cancel),
+                MessageHandler(filters.ALL, still_working),
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
     )
 
     application.add_handler(conv_handler)
-    
+    return application
+
+def main():
+    """Run the bot."""
+    setup_logging()
+    jobs.purge()
+    sessions.open()
+    application = build_application()
+
     # Start the Bot
-    print("Starting bot...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        log.info("Starting bot with a webhook at %s...", WEBHOOK_URL)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        log.info("Starting bot...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from dotenv import load_dotenv
+from drawJobFile import hash_file, read_job, write_job
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Disk cache settings
+CACHE_DIR = os.getenv('CACHE_DIR', 'cache')
+CACHE_MAX_MB = float(os.getenv('CACHE_MAX_MB', '200'))
+
+
+class DrawCache:
+    """Disk cache of processed drawings keyed by image content and parameters.
+
+    Each entry is a directory holding the point list as a compiled job
+    file, the post-processing reports and the preview images. Entries are evicted least recently used
+    first once the cache grows past its size limit.
+    """
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes  # The root directory is created with the first entry
+
+    def key(self, image_path, params, *extra):
+        """Hash of the image bytes plus the normalized parameter set."""
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        normalized = {name: (int(value) if isinstance(value, bool) else value) for name, value in params.items()}
+        digest.update(json.dumps([normalized, extra], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key, job):
+        """Fill the job from the cache. Returns True on a hit."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, 'result.json')) as f:
+                result = json.load(f)
+            # Read rather than mapped, so eviction can always delete the entry
+            _, waypoints = read_job(os.path.join(entry, 'points.drawjob'), mmap=False)
+            previews = {}
+            for name in result['previews']:
+                with open(os.path.join(entry, f"preview_{name}"), 'rb') as f:
+                    previews[name] = f.read()
+        except (OSError, ValueError, KeyError):  # Missing, damaged or from an older layout
+            return False
+
+        job.points = waypoints.tolist()
+        job.reports = result['reports']
+        job.previews = previews
+        os.utime(entry)  # Mark as recently used
+        return True
+
+    def store(self, key, job):
+        """Save the job's results and evict old entries if needed."""
+        entry = self._entry(key)
+        staging = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(staging, exist_ok=True)
+        for name, data in job.previews.items():
+            with open(os.path.join(staging, f"preview_{name}"), 'wb') as f:
+                f.write(data)
+        write_job(os.path.join(staging, 'points.drawjob'), job.points, job.params, hash_file(job.image_path))
+        with open(os.path.join(staging, 'result.json'), 'w') as f:
+            json.dump({'reports': job.reports, 'previews': list(job.previews), 'stored': time.time()}, f)
+
+        # Publish the entry in one step so readers never see it half written
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its limit."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path) or name.endswith('.tmp'):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+            total += size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,200 @@
+"""
+Drawing time estimation for the robotic arm.
+
+Every waypoint is modelled as a fixed overhead (command round trip and, in
+blocking mode, the pause after each point) plus the time each axis needs to
+cover its distance, plus a settle pause after every pen lift or drop. The
+coefficients start from defaults and are refitted by non-negative least
+squares from the waypoint timings logged by finished drawings.
+"""
+
+import json
+import os
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+from dotenv import load_dotenv
+from plcBridge import STREAM_MODE, SETTLE_TIME, Ponto_inicial
+
+# Load variables from .env into the environment
+load_dotenv()
+
+MOVES_LOG = os.getenv('MOVES_LOG', 'moves.jsonl')     # Waypoint timings of recent drawings, empty to disable
+ARM_SPEED = float(os.getenv('ARM_SPEED', '50'))       # mm/s per axis before any calibration
+CALIBRATION_JOBS = int(os.getenv('CALIBRATION_JOBS', '20'))  # Most recent drawings used for fitting
+CALIBRATION_MIN_MOVES = 50  # Keep the defaults until this many waypoints were timed
+HOME_PAUSE = 2.0            # mover_braco pauses this long after reaching the start point
+
+
+@dataclass(slots=True)
+class MotionModel:
+    """Seconds per waypoint: overhead + per-axis travel time + settle after pen moves."""
+    overhead: float
+    seconds_per_mm: tuple  # x, y and z
+    settle: float
+
+    @classmethod
+    def default(cls, stream=STREAM_MODE):
+        pace = 1 / ARM_SPEED
+        if stream:
+            return cls(overhead=0.05, seconds_per_mm=(pace, pace, pace), settle=SETTLE_TIME)
+        # mover_braco waits for an exact arrival and sleeps 2 s after every point
+        return cls(overhead=2.1, seconds_per_mm=(pace, pace, pace), settle=0.0)
+
+    @property
+    def velocities(self):
+        """Calibrated speed of each axis in mm/s (inf when travel time is negligible)."""
+        return tuple(1 / s if s > 0 else float('inf') for s in self.seconds_per_mm)
+
+    def coefficients(self):
+        return np.array([self.overhead, *self.seconds_per_mm, self.settle])
+
+
+def _move_features(points):
+    """
+    Regression features of every move along a path.
+
+    Args:
+        points (list): Path as a list of [x, y, z, a, e, r] points, starting where the arm is
+
+    Returns:
+        tuple: (n - 1, 5) feature matrix [1, |dx|, |dy|, |dz|, settles] and
+            the xy distance of each move
+    """
+    array = np.asarray(points, dtype=float)
+    deltas = np.abs(np.diff(array[:, :3], axis=0))
+    vertical = deltas[:, 2] > 0
+    # The settle pause follows the pen move, so it lands on the next waypoint
+    settles = np.concatenate([[0.0], vertical[:-1]])
+    features = np.column_stack([np.ones(len(deltas)), deltas, settles])
+    return features, np.hypot(deltas[:, 0], deltas[:, 1])
+
+
+class DrawEstimator:
+    """Predict drawing times and refine the motion model from real drawings."""
+
+    def __init__(self, log_path=MOVES_LOG, stream=STREAM_MODE, home=Ponto_inicial):
+        self.log_path = log_path
+        self.stream = stream
+        self.home = list(home)
+        self.model = MotionModel.default(stream)
+        self.samples = deque(maxlen=CALIBRATION_JOBS)  # (features, durations) of recent drawings
+        self.logged = 0  # Drawings in the log file
+        self._load_log()
+        self.calibrate()
+
+    def _read_log(self):
+        """Logged drawings, oldest first, skipping damaged lines."""
+        records = []
+        with open(self.log_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def _load_log(self):
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        records = self._read_log()
+        self.logged = len(records)
+        for record in records:
+            if record.get('stream') == self.stream:
+                self._add_sample(record['points'], record['times'])
+        if self.logged > 2 * CALIBRATION_JOBS:
+            self._trim_log(records)
+
+    def _trim_log(self, records=None):
+        """Rewrite the log with only the CALIBRATION_JOBS most recent drawings of each motion mode."""
+        records = self._read_log() if records is None else records
+        kept, counts = [], {}
+        for record in reversed(records):
+            mode = record.get('stream')
+            if counts.get(mode, 0) < CALIBRATION_JOBS:
+                counts[mode] = counts.get(mode, 0) + 1
+                kept.append(record)
+        kept.reverse()
+
+        staging = f'{self.log_path}.{os.getpid()}.tmp'
+        with open(staging, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in kept)
+        os.replace(staging, self.log_path)
+        self.logged = len(kept)
+
+    def _add_sample(self, points, times):
+        if len(times) != len(points) or not points:
+            return
+        features, _ = _move_features([self.home] + points)
+        durations = np.diff(np.concatenate([[0.0], times]))
+        self.samples.append((features, durations))
+
+    def estimate(self, points):
+        """
+        Predict how long drawing a path takes.
+
+        Args:
+            points (list): Path as a list of [x, y, z, a, e, r] points
+
+        Returns:
+            dict: Seconds in total, with the pen down and with the pen up
+                (travel, lifts and the trips from and back to the start point),
+                plus the distance travelled in mm with the pen down and up
+        """
+        if not points:
+            return {'total': 0.0, 'pen_down': 0.0, 'pen_up': 0.0, 'pen_down_travel': 0.0, 'pen_up_travel': 0.0}
+
+        features, distances = _move_features([self.home] + list(points) + [self.home])
+        seconds = features @ self.model.coefficients()
+
+        # A move draws when it starts and ends at the drawing height of the first point
+        z = np.abs(np.asarray([self.home[2]] + [p[2] for p in points] + [self.home[2]], dtype=float))
+        down = z <= abs(points[0][2])
+        drawing = down[:-1] & down[1:]
+        drawing[[0, -1]] = False  # Trips to and from the start point
+
+        pen_down = float(seconds[drawing].sum())
+        pen_up = float(seconds[~drawing].sum()) + 2 * HOME_PAUSE
+        return {
+            'total': pen_down + pen_up,
+            'pen_down': pen_down,
+            'pen_up': pen_up,
+            'pen_down_travel': float(distances[drawing].sum()),
+            'pen_up_travel': float(distances[~drawing].sum()),
+        }
+
+    def record(self, points, times):
+        """
+        Log the waypoint timings of a finished drawing and refit the model.
+
+        The log keeps the last CALIBRATION_JOBS drawings of each motion mode,
+        the ones calibration uses, plus at most as many not yet trimmed.
+
+        Args:
+            points (list): The drawn path
+            times (list): Seconds from leaving the start point until each waypoint was reached
+        """
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({'stream': self.stream, 'points': points, 'times': list(times)}) + '\n')
+            self.logged += 1
+            # Only the calibration window is ever used; trimming now and then keeps appends cheap
+            if self.logged > 2 * CALIBRATION_JOBS:
+                self._trim_log()
+        self._add_sample(points, times)
+        self.calibrate()
+
+    def calibrate(self):
+        """Fit the motion model to the logged drawings. Returns True if it was updated."""
+        if sum(len(durations) for _, durations in self.samples) < CALIBRATION_MIN_MOVES:
+            return False
+        from scipy.optimize import nnls  # Imported here to keep scipy out of the bot's startup
+        features = np.concatenate([f for f, _ in self.samples])
+        durations = np.concatenate([d for _, d in self.samples])
+        coefficients, _ = nnls(features, durations)
+        self.model = MotionModel(
+            overhead=float(coefficients[0]),
+            seconds_per_mm=tuple(float(c) for c in coefficients[1:4]),
+            settle=float(coefficients[4]),
+        )
+        return True
@@ -0,0 +1,286 @@
+"""
+Compiled drawing jobs.
+
+A .drawjob file holds a drawing ready for the arm, so it can be reloaded
+instantly and replayed or resumed without processing the image again:
+
+    magic    6 bytes   b'DRWJOB'
+    version  uint16    little-endian
+    length   uint32    little-endian, size of the JSON header in bytes
+    header   JSON      params, source_sha256, drawing area, count, strokes, ...
+                       padded with spaces so the waypoints start 64-byte aligned
+    data     int32     little-endian, count x 6 axes [x, y, z, a, e, r]
+
+The waypoints are read through a memory map. `strokes` lists the index
+where each pen-down stroke starts. While a job file is being drawn, the
+index of the next waypoint is kept next to it in <file>.progress, so an
+interrupted drawing can be resumed.
+
+    python drawJobFile.py compile photo.png -o photo.drawjob --set process_cell_size=2
+    python drawJobFile.py inspect photo.drawjob
+    python drawJobFile.py replay photo.drawjob --resume
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+MAGIC = b'DRWJOB'
+VERSION = 1
+PREAMBLE = struct.Struct('<6sHI')
+ALIGNMENT = 64
+DTYPE = np.dtype('<i4')
+AXES = 6
+
+
+def hash_file(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stroke_starts(waypoints):
+    """Indices where pen-down strokes start (first point pen down, larger |z| pen up)."""
+    if not len(waypoints):
+        return []
+    down = np.abs(waypoints[:, 2]) <= abs(waypoints[0, 2])
+    starts = np.flatnonzero(down & ~np.concatenate(([False], down[:-1])))
+    return starts.tolist()
+
+
+def write_job(path, points, params=None, source_sha256=None, upper_left_edge=None, bottom_right_edge=None):
+    """
+    Save a drawing as a job file, replacing it in one step.
+
+    Args:
+        path (str): Output file
+        points (list): Path as [x, y, z, a, e, r] points
+        params (dict, optional): Drawing parameters the path was computed with
+        source_sha256 (str, optional): Hash of the source image (see hash_file)
+        upper_left_edge (list, optional): Drawing area the path was planned for
+        bottom_right_edge (list, optional): Drawing area the path was planned for
+
+    Returns:
+        dict: The header that was written
+    """
+    waypoints = np.asarray(points).reshape(-1, AXES)
+    if not np.issubdtype(waypoints.dtype, np.integer):
+        waypoints = np.rint(waypoints)
+    info = np.iinfo(DTYPE)
+    if len(waypoints) and (waypoints.min() < info.min or waypoints.max() > info.max):
+        raise ValueError("Waypoint coordinates do not fit in int32")
+    waypoints = waypoints.astype(DTYPE)
+
+    header = {
+        'count': len(waypoints),
+        'params': params or {},
+        'source_sha256': source_sha256,
+        'upper_left_edge': upper_left_edge,
+        'bottom_right_edge': bottom_right_edge,
+        'strokes': stroke_starts(waypoints),
+        'created': time.time(),
+    }
+    encoded = json.dumps(header).encode()
+    encoded += b' ' * (-(PREAMBLE.size + len(encoded)) % ALIGNMENT)
+
+    staging = f'{path}.{os.getpid()}.tmp'
+    with open(staging, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        f.write(waypoints.tobytes())
+    os.replace(staging, path)
+    return header
+
+
+def read_job(path, mmap=True):
+    """
+    Open a job file.
+
+    Args:
+        path (str): Job file
+        mmap (bool): Map the waypoints instead of reading them into memory
+
+    Returns:
+        tuple: Header dict and the (count, 6) int32 waypoint array
+    """
+    with open(path, 'rb') as f:
+        preamble = f.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise ValueError(f"{path} is not a drawing job file")
+        magic, version, length = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a drawing job file")
+        if version > VERSION:
+            raise ValueError(f"{path} is a version {version} job file; this code reads up to version {VERSION}")
+        header = json.loads(f.read(length))
+
+    offset = PREAMBLE.size + length
+    count = header['count']
+    if os.path.getsize(path) < offset + count * AXES * DTYPE.itemsize:
+        raise ValueError(f"{path} is truncated")
+    if not count:
+        return header, np.empty((0, AXES), DTYPE)
+    if mmap:
+        return header, np.memmap(path, DTYPE, 'r', offset, (count, AXES))
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return header, np.fromfile(f, DTYPE, count * AXES).reshape(count, AXES)
+
+
+def _progress_path(path):
+    return f'{path}.progress'
+
+
+def save_progress(path, index):
+    """Remember that the job's waypoints before `index` were drawn."""
+    with open(_progress_path(path), 'w') as f:
+        json.dump({'next': index, 'saved': time.time()}, f)
+
+
+def load_progress(path):
+    """Index of the first waypoint not drawn yet, 0 if the job never ran or finished."""
+    try:
+        with open(_progress_path(path)) as f:
+            return int(json.load(f)['next'])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def clear_progress(path):
+    try:
+        os.remove(_progress_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def _parse_overrides(pairs):
+    """Turn name=value pairs into DrawParams, typed like the defaults."""
+    from sessionStore import DrawParams
+    defaults = DrawParams().as_dict()
+    values = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        if name not in defaults:
+            raise SystemExit(f"Unknown parameter {name!r}; choose from {', '.join(defaults)}")
+        if isinstance(defaults[name], bool):
+            values[name] = value.strip().lower() in ('1', 'true', 'yes')
+        else:
+            values[name] = int(value)
+    return DrawParams(**values).as_dict()
+
+
+def compile_job(source, output, params):
+    """Compile an image, or a recorded point list, into a job file."""
+    from armFleet import UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE
+    if source.endswith(('.txt', '.json', '.jsonl')):
+        from benchDraw import load_paths
+        points = load_paths(source)[0][1]
+        params = None
+    else:
+        import tempfile
+        from drawPipeline import run_pipeline
+        with tempfile.TemporaryDirectory(prefix='drawjob_') as work_dir:
+            points, _, _, _ = run_pipeline(source, work_dir, dict(params, quick_preview=False),
+                                           UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE)
+    return write_job(output, points, params, hash_file(source), UPPER_LEFT_EDGE, BOTTOM_RIGHT_EDGE)
+
+
+def inspect_job(path):
+    """Print a summary of a job file."""
+    from drawEstimator import DrawEstimator
+    from pathOptimizer import path_stats
+    header, waypoints = read_job(path)
+    points = waypoints.tolist()
+    estimate = DrawEstimator().estimate(points)
+    print(f"{path}: {header['count']} waypoints, {len(header['strokes'])} strokes, "
+          f"{os.path.getsize(path) / 1024:.1f} KiB")
+    if len(waypoints):
+        print(f"  x {waypoints[:, 0].min()}..{waypoints[:, 0].max()}  y {waypoints[:, 1].min()}..{waypoints[:, 1].max()}"
+              f"  z {waypoints[:, 2].min()}..{waypoints[:, 2].max()}")
+    print(f"  pen-up travel {path_stats(points)['pen_up_travel']:.0f} mm, estimated {estimate['total'] / 60:.1f} min")
+    print(f"  source sha256 {header['source_sha256']}")
+    print(f"  created {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['created']))}")
+    if header['params']:
+        print("  params " + ', '.join(f'{k}={v}' for k, v in header['params'].items()))
+    progress = load_progress(path)
+    if progress:
+        print(f"  interrupted: resumes at waypoint {progress}")
+
+
+async def replay_job(path, start, host, port, simulate, speed):
+    """Draw a job file on the arm, or on a local simulator."""
+    import plcBridge
+    simulator = None
+    if simulate:
+        from plcSimulator import PLCSimulator
+        simulator = PLCSimulator(speed)
+        host, port = '127.0.0.1', await simulator.start()
+    sessao = plcBridge.SessaoCLP(host, port)
+    try:
+        started = time.perf_counter()
+        await plcBridge.makeDraw(path, inicio=start, sessao=sessao)
+        print(f"Drew {path} from waypoint {start} in {time.perf_counter() - started:.1f}s")
+    finally:
+        await sessao.encerrar()
+        if simulator is not None:
+            await simulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile, inspect and replay drawing jobs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = commands.add_parser('compile', help='Process an image (or a point list) into a job file')
+    compile_parser.add_argument('source', help='Image, robot_commands.txt or JSON point list')
+    compile_parser.add_argument('-o', '--output', help='Job file, by default next to the source')
+    compile_parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                                help='Drawing parameter, as in /params (repeatable)')
+
+    inspect_parser = commands.add_parser('inspect', help='Summarize a job file')
+    inspect_parser.add_argument('job')
+
+    replay_parser = commands.add_parser('replay', help='Draw a job file')
+    replay_parser.add_argument('job')
+    start = replay_parser.add_mutually_exclusive_group()
+    start.add_argument('--start', type=int, default=0, help='Index of the first waypoint to draw')
+    start.add_argument('--resume', action='store_true', help='Continue where the last run was interrupted')
+    replay_parser.add_argument('--host', help='CLP address, CLP_IP by default')
+    replay_parser.add_argument('--port', type=int, help='CLP port, CLP_PORT by default')
+    replay_parser.add_argument('--simulate', action='store_true', help='Draw on a local simulated CLP')
+    replay_parser.add_argument('--speed', type=float, default=100.0, help='Axis speed of the simulated CLP')
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        output = args.output or os.path.splitext(args.source)[0] + '.drawjob'
+        started = time.perf_counter()
+        header = compile_job(args.source, output, _parse_overrides(args.set))
+        print(f"Wrote {output}: {header['count']} waypoints, {len(header['strokes'])} strokes "
+              f"in {time.perf_counter() - started:.1f}s")
+    elif args.command == 'inspect':
+        inspect_job(args.job)
+    else:
+        start = load_progress(args.job) if args.resume else args.start
+        header, _ = read_job(args.job)
+        if args.resume and start >= header['count']:
+            clear_progress(args.job)
+            print(f"{args.job} was already drawn to the end; nothing to resume")
+            return
+        if not 0 <= start < max(header['count'], 1):
+            sys.exit(f"Start index {start} is outside the job's {header['count']} waypoints")
+        try:
+            asyncio.run(replay_job(args.job, start, args.host, args.port, args.simulate, args.speed))
+        except KeyboardInterrupt:
+            print(f"Interrupted at waypoint {load_progress(args.job)}; continue with --resume")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Root directory for per-job scratch workspaces
+JOBS_DIR = os.getenv('JOBS_DIR', 'steps')
+
+
+class DrawJob:
+    """One drawing request with its own id, workspace and results."""
+
+    def __init__(self, user_id, root=JOBS_DIR):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.created = time.time()
+        self.workspace = os.path.join(root, str(user_id), self.job_id)
+        os.makedirs(self.workspace, exist_ok=True)
+        self.image_path = self.output('input.png')
+        self.points = []
+        self.reports = {}
+        self.previews = {}           # Preview name -> encoded image, in sending order
+        self.params = None           # Parameters of the current points and previews
+        self.quick = False           # Only a quick preview exists, the points are not computed yet
+        self.artifacts = {}          # Pipeline stage outputs, reused by /reprocess
+        self.artifact_params = None  # Parameters the artifacts were computed with
+
+    def output(self, name):
+        """Path of a file inside this job's workspace."""
+        return os.path.join(self.workspace, name)
+
+    def cleanup(self):
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+
+class JobStore:
+    """Keep the latest job of each user, removing the workspace it replaces.
+
+    A job lives until the user starts another one or their session is
+    evicted (see SessionStore.on_evict), whichever comes first.
+    """
+
+    def __init__(self, root=JOBS_DIR):
+        self.root = root
+        self.jobs = {}
+
+    def new(self, user_id):
+        old = self.jobs.get(user_id)
+        if old is not None:
+            old.cleanup()
+        job = DrawJob(user_id, self.root)
+        self.jobs[user_id] = job
+        return job
+
+    def get(self, user_id):
+        return self.jobs.get(user_id)
+
+    def drop(self, user_id):
+        """Forget the user's job and remove its workspace."""
+        job = self.jobs.pop(user_id, None)
+        if job is not None:
+            job.cleanup()
+            try:
+                os.rmdir(os.path.dirname(job.workspace))  # The user's directory, once empty
+            except OSError:
+                pass
+
+    def purge(self):
+        """Remove the workspaces left over by a previous run, which no job refers to anymore."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and name.lstrip('-').isdigit() and int(name) not in self.jobs:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,406 @@
+"""
+Image-to-points pipeline run by the processing workers.
+
+Runs the same stages as AmericoDraws.independencia_ou_morte, with the
+optional post-processing of pathOptimizer (decimation and stroke ordering)
+applied before the previews are rendered, so the previews show the path
+that will actually be drawn.
+
+Previews are rendered into memory and returned as encoded image bytes,
+downscaled and JPEG-encoded by default so they upload quickly.
+
+quick_preview runs the first stages on a downscaled image and sketches the
+result with OpenCV, for fast iteration on parameters before the full path
+is computed.
+
+Each stage keeps its output in an artifacts dict. Passing those artifacts
+back in with a later start stage recomputes only what a parameter change
+actually affects.
+
+rembg and AmericoDraws take seconds to import, so they are only imported
+by the functions that use them: the bot imports this module for its stage
+table and never pays for them. warm_up, the worker initializer, imports
+them as each worker starts, and loads the background removal model too
+when WARMUP_REMBG is set. The bot downloads that model itself, with
+fetch_background_model, before any worker needs it.
+"""
+
+import io
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+from metrics import event, setup_logging
+from pathOptimizer import simplify_path, optimize_stroke_order, ARM_RESOLUTION, COLLINEAR_TOLERANCE
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Workers render previews without a display; set before AmericoDraws imports pyplot
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# Preview encoding
+PREVIEW_MAX_SIDE = int(os.getenv('PREVIEW_MAX_SIDE', '2048'))         # Longest side in pixels, 0 keeps full size
+PREVIEW_JPEG_QUALITY = int(os.getenv('PREVIEW_JPEG_QUALITY', '90'))   # 0 sends lossless PNG instead
+QUICK_PREVIEW_SIDE = int(os.getenv('QUICK_PREVIEW_SIDE', '256'))      # Longest side of the image in quick previews
+QUICK_SKETCH_SIDE = 1024  # Longest side of the quick preview sketch in pixels
+
+# Background removal model
+REMBG_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+WARMUP_REMBG = os.getenv('WARMUP_REMBG', '0') == '1'  # Load the model (~170 MB per worker) as workers start
+
+PIPELINE_VERSION = 2  # Bump when a code change alters the points or previews, so cached results are recomputed
+
+# Settings outside the parameter set that change the pipeline's output; part of DrawCache keys
+OUTPUT_SETTINGS = {
+    'pipeline_version': PIPELINE_VERSION,
+    'arm_resolution': ARM_RESOLUTION,
+    'collinear_tolerance': COLLINEAR_TOLERANCE,
+    'preview_max_side': PREVIEW_MAX_SIDE,
+    'preview_jpeg_quality': PREVIEW_JPEG_QUALITY,
+    'quick_preview_side': QUICK_PREVIEW_SIDE,
+    'quick_sketch_side': QUICK_SKETCH_SIDE,
+    'rembg_model': REMBG_MODEL,
+}
+
+log = logging.getLogger('drawPipeline')
+
+_rembg_session = None
+_rembg_model_path = None
+_rembg_download_lock = threading.Lock()
+
+# Pipeline stages in order, with the parameters each one reads
+STAGES = [
+    ('background', ('remove_background', 'bg_threshold', 'bg_erode_pixels')),
+    ('contours', ('threshold1', 'threshold2', 'blur_size')),
+    ('matrix', ('process_cell_size',)),
+    ('points', ('points_cell_width', 'z_up', 'distance_threshold', 'epsilon')),
+    ('postprocess', ('simplify_path', 'optimize_path')),
+    ('preview', ('linewidth',)),
+]
+STAGE_NAMES = [name for name, _ in STAGES]
+
+
+def first_stale_stage(old_params, new_params):
+    """
+    Find the earliest stage affected by a parameter change.
+
+    Returns:
+        str: Stage name, or None if no parameter changed
+    """
+    for name, stage_params in STAGES:
+        if any(old_params.get(p) != new_params.get(p) for p in stage_params):
+            return name
+    return None
+
+
+def fetch_background_model():
+    """
+    Download the background removal model unless it is already on disk.
+
+    Meant for the bot's process, before workers load the model, so several
+    workers never download the same file at once. Safe to call from
+    several threads; only the first call does any work.
+
+    Returns:
+        str: Path of the model file
+    """
+    global _rembg_model_path
+    with _rembg_download_lock:
+        if _rembg_model_path is None:
+            _rembg_model_path = _background_model_class().download_models()
+    return _rembg_model_path
+
+
+def _background_model_class():
+    from rembg.sessions import sessions_class
+    return next(c for c in sessions_class if c.name() == REMBG_MODEL)
+
+
+def _background_model_on_disk():
+    session_class = _background_model_class()
+    return os.path.exists(os.path.join(session_class.u2net_home(), f'{session_class.name()}.onnx'))
+
+
+def background_session():
+    """rembg session of this process, loaded once and reused by every job."""
+    global _rembg_session
+    if _rembg_session is None:
+        from rembg import new_session
+        _rembg_session = new_session(REMBG_MODEL)
+    return _rembg_session
+
+
+def warm_up():
+    """
+    Worker initializer: import the heavy modules and load the background
+    removal model before the first job arrives.
+
+    Never raises, since a failing initializer breaks the whole pool; a model
+    that cannot be loaded now is loaded again on first use.
+    """
+    setup_logging()
+    timings = {}
+    with _profiled(timings, 'imports'):
+        import rembg, scipy.spatial, AmericoDraws.path_planning, AmericoDraws.visualization  # noqa: F401
+    if WARMUP_REMBG:
+        try:
+            if not _background_model_on_disk():
+                # Left to the bot's process, see fetch_background_model
+                raise FileNotFoundError('not downloaded yet')
+            with _profiled(timings, 'rembg'):
+                # One tiny image also initializes the inference session
+                rembg.remove(Image.new('RGB', (32, 32)), session=background_session())
+        except Exception as e:
+            log.warning('Could not preload the %s background removal model: %s', REMBG_MODEL, e)
+    event(log, 'worker_ready', pid=os.getpid(), **{f'{step}_s': f"{t['seconds']:.2f}" for step, t in timings.items()})
+
+
+def _load_grayscale(input_path, params, max_side=None):
+    """Stage 1: optional background removal, then a grayscale copy of the image.
+
+    With max_side, the image is first shrunk so its longest side fits.
+    """
+    if not params['remove_background']:
+        image = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE)
+        scale = max_side / max(image.shape) if max_side else 1
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return image
+
+    img = Image.open(input_path)
+    if max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    from rembg import remove as rembg_remove
+    from AmericoDraws.contour_extraction import clean_alpha_edges, erode_alpha
+    img_no_bg = rembg_remove(img, session=background_session())
+    img_no_bg = clean_alpha_edges(img_no_bg, threshold=params['bg_threshold'])
+    img_no_bg = erode_alpha(img_no_bg, pixels=params['bg_erode_pixels'])
+
+    # Decode the PNG exactly as AmericoDraws re-reads it from disk
+    buffer = io.BytesIO()
+    img_no_bg.save(buffer, "PNG")
+    return cv2.imdecode(np.frombuffer(buffer.getvalue(), np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def _extract_contours(image, params):
+    """Stage 2: Canny contours drawn one pixel wide, as in AmericoDraws.extract_contours."""
+    # Flood fill from top-left corner to unify background
+    flood_filled = image.copy()
+    h, w = flood_filled.shape[:2]
+    mask = np.zeros((h + 2, w + 2), np.uint8)
+    cv2.floodFill(flood_filled, mask, seedPoint=(0, 0), newVal=255)
+    cv2.floodFill(flood_filled, mask, seedPoint=(0, 0), newVal=0)
+
+    blurred = cv2.GaussianBlur(flood_filled, (params['blur_size'], params['blur_size']), 0)
+    edges = cv2.Canny(blurred, params['threshold1'], params['threshold2'])
+    contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    contour_image = np.ones_like(image) * 255
+    cv2.drawContours(contour_image, contours, -1, (0,), 1)
+    return contour_image
+
+
+def _encode_preview(image):
+    """Downscale a PIL image and encode it for upload."""
+    if PREVIEW_MAX_SIDE:
+        image.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if PREVIEW_JPEG_QUALITY:
+        image.convert('RGB').save(buffer, 'JPEG', quality=PREVIEW_JPEG_QUALITY)
+    else:
+        image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _render_previews(points, upper_left_edge, bottom_right_edge, linewidth):
+    """Render the 3D path and the sketch into memory instead of PNG files."""
+    from AmericoDraws.visualization import visualization_3d
+    path_3d = io.BytesIO()
+    sketch = io.BytesIO()
+    visualization_3d(points, upper_left_edge, bottom_right_edge, path_3d, sketch, linewidth)
+    previews = {}
+    for name, buffer in (('3d_path', path_3d), ('final_result', sketch)):
+        if buffer.getbuffer().nbytes:
+            previews[name] = _encode_preview(Image.open(buffer))
+    return previews
+
+
+def _quick_sketch(points, upper_left_edge, bottom_right_edge, linewidth):
+    """Draw the pen-down segments with OpenCV, as a fast stand-in for the matplotlib sketch."""
+    width = bottom_right_edge[0] - upper_left_edge[0]
+    height = bottom_right_edge[1] - upper_left_edge[1]
+    scale = QUICK_SKETCH_SIDE / max(width, height)
+    canvas = np.full((round(height * scale), round(width * scale), 3), 255, np.uint8)
+    if not points:
+        return Image.fromarray(canvas)
+
+    array = np.asarray(points, dtype=float)
+    down = np.abs(array[:, 2]) <= abs(array[0, 2])
+    xy = np.rint((array[:, :2] - upper_left_edge[:2]) * scale).astype(np.int32)
+    segments = np.stack([xy[:-1], xy[1:]], axis=1)[down[:-1] & down[1:]]
+    # visualization_3d draws a 10 inch (720 pt) wide figure, so scale the line width to match
+    thickness = max(1, round(linewidth * QUICK_SKETCH_SIDE / 720))
+    cv2.polylines(canvas, list(segments), False, (0, 0, 255), thickness)
+    return Image.fromarray(canvas)
+
+
+def _to_matrix(contour_image, cell_size):
+    """Stage 3: binary matrix of the contour image, as AmericoDraws.process_image builds it."""
+    # process_image samples pixel (i, j) for grid cell (i, j), for any cell size
+    rows = contour_image.shape[0] // cell_size
+    cols = contour_image.shape[1] // cell_size
+    return (contour_image[:rows, :cols] < 128).astype(np.uint8)
+
+
+def quick_preview(input_path, params, upper_left_edge, bottom_right_edge, max_side=QUICK_PREVIEW_SIDE):
+    """
+    Rough preview of the drawing, computed on a downscaled image.
+
+    Runs background removal, contour extraction and path planning at low
+    resolution, skips post-processing and the 3D plot, and sketches the
+    strokes with OpenCV. The points are only good for judging the
+    parameters; run_pipeline computes the ones that get drawn.
+
+    Args:
+        input_path (str): Path to the input image
+        params (dict): Drawing parameters (see sessionStore.DrawParams)
+        upper_left_edge (list): Upper left edge coordinates [x, y, z, a, e, r]
+        bottom_right_edge (list): Bottom right edge coordinates [x, y, z, a, e, r]
+        max_side (int): Longest side of the downscaled image in pixels
+
+    Returns:
+        dict: Encoded previews (contour and final_result)
+    """
+    from AmericoDraws.path_planning import create_points_array
+    image = _load_grayscale(input_path, params, max_side)
+    contour_image = _extract_contours(image, params)
+    matrix = _to_matrix(contour_image, params['process_cell_size'])
+    points = create_points_array(
+        matrix.tolist(),
+        params['points_cell_width'],
+        upper_left_edge,
+        bottom_right_edge,
+        z_up=params['z_up'],
+        distance_threshold=params['distance_threshold'],
+        epsilon=params['epsilon']
+    )
+    return {
+        'contour': _encode_preview(Image.fromarray(contour_image)),
+        'final_result': _encode_preview(_quick_sketch(points, upper_left_edge, bottom_right_edge, params['linewidth'])),
+    }
+
+
+@contextmanager
+def _profiled(profile, step):
+    """Record the wall time of a step, and its traced memory peak while tracemalloc runs."""
+    if profile is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile[step] = {'seconds': time.perf_counter() - started}
+        if tracing:
+            profile[step]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+
+
+def run_pipeline_profiled(*args, **kwargs):
+    """run_pipeline that also returns its step timings, for callers in another process."""
+    profile = {}
+    return run_pipeline(*args, profile=profile, **kwargs), profile
+
+
+def run_pipeline(input_path, output_dir, params, upper_left_edge, bottom_right_edge,
+                 artifacts=None, start='background', profile=None):
+    """
+    Process an image into robot points using the user's drawing parameters.
+
+    Args:
+        input_path (str): Path to the input image
+        output_dir (str): Directory for intermediate files and previews
+        params (dict): Drawing parameters (see sessionStore.DrawParams)
+        upper_left_edge (list): Upper left edge coordinates [x, y, z, a, e, r]
+        bottom_right_edge (list): Bottom right edge coordinates [x, y, z, a, e, r]
+        artifacts (dict, optional): Stage outputs of a previous run on the same image
+        start (str): First stage to recompute; earlier stages come from `artifacts`
+        profile (dict, optional): Filled with the wall time of each step that runs, and
+            its memory peak when tracemalloc is tracing (see benchPipeline.py)
+
+    Returns:
+        tuple: List of points, a dict with post-processing reports, the encoded previews
+            (contour, 3d_path and final_result, in that order) and the stage artifacts
+    """
+    from AmericoDraws.path_planning import create_points_array
+    from AmericoDraws.visualization import save_robot_commands
+    os.makedirs(output_dir, exist_ok=True)
+    artifacts = dict(artifacts or {})
+    first = STAGE_NAMES.index(start)
+
+    def stale(stage):
+        return STAGE_NAMES.index(stage) >= first
+
+    robot_commands_path = os.path.join(output_dir, "robot_commands.txt")
+
+    # Step 1: Remove background if requested, otherwise use original image
+    if stale('background'):
+        with _profiled(profile, 'background'):
+            artifacts['image'] = _load_grayscale(input_path, params)
+
+    # Step 2: Extract contours
+    if stale('contours'):
+        with _profiled(profile, 'contours'):
+            artifacts['contour_image'] = _extract_contours(artifacts['image'], params)
+        with _profiled(profile, 'contour_preview'):
+            artifacts['contour_preview'] = _encode_preview(Image.fromarray(artifacts['contour_image']))
+
+    # Step 3: Convert to matrix
+    if stale('matrix'):
+        with _profiled(profile, 'matrix'):
+            artifacts['matrix'] = _to_matrix(artifacts['contour_image'], params['process_cell_size'])
+
+    # Step 4: Create optimized points array
+    if stale('points'):
+        with _profiled(profile, 'points'):
+            artifacts['raw_points'] = create_points_array(
+                artifacts['matrix'].tolist(),
+                params['points_cell_width'],
+                upper_left_edge,
+                bottom_right_edge,
+                z_up=params['z_up'],
+                distance_threshold=params['distance_threshold'],
+                epsilon=params['epsilon']
+            )
+
+    # Steps 5 and 6: Drop redundant points, then reorder strokes to cut pen-up travel
+    if stale('postprocess'):
+        points = artifacts['raw_points']
+        reports = {}
+        if params['simplify_path']:
+            with _profiled(profile, 'simplify'):
+                points, reports['simplify'] = simplify_path(points, upper_left_edge, bottom_right_edge)
+        if params['optimize_path']:
+            with _profiled(profile, 'stroke_order'):
+                points, reports['stroke_order'] = optimize_stroke_order(points, params['distance_threshold'])
+        artifacts['points'] = points
+        artifacts['reports'] = reports
+
+    # Step 7: Visualize and save results
+    points = artifacts['points']
+    previews = {'contour': artifacts['contour_preview']}
+    with _profiled(profile, 'preview'):
+        previews.update(_render_previews(points, upper_left_edge, bottom_right_edge, params['linewidth']))
+    with _profiled(profile, 'save'):
+        save_robot_commands(points, robot_commands_path)
+
+    return points, artifacts['reports'], previews, artifacts
@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from plcBridge import makeDraw
+from drawEstimator import DrawEstimator
+from armFleet import ArmFleet
+
+# Load variables from .env into the environment
+load_dotenv()
+
+ARM_RECHECK_INTERVAL = float(os.getenv('ARM_RECHECK_INTERVAL', '5'))  # Seconds between looks for an arm back online
+
+log = logging.getLogger('drawScheduler')
+
+
+class QueuedDraw:
+    """A confirmed job waiting for (or using) the arm."""
+
+    def __init__(self, job, notify, priority, seq):
+        self.job = job
+        self.points = list(job.points)  # As confirmed; /reprocess replaces the job's points, not these
+        self.notify = notify  # async callable(text) that messages the job's owner
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.time()
+        self.started = None
+        self.arm = None
+        self.attempts = 0  # Arms that went offline while drawing it
+
+    @property
+    def order(self):
+        return (self.priority, self.seq)
+
+
+class DrawScheduler:
+    """Queue of confirmed drawings dispatched to the arms of a fleet.
+
+    Jobs run in FIFO order within the same priority; lower priority values
+    go first. Each job goes to the least-loaded arm that is idle and
+    online. A job whose arm goes offline mid-drawing is put back at the
+    front of the queue for another arm.
+    """
+
+    def __init__(self, fleet=None, draw=makeDraw, estimator=None):
+        self.fleet = fleet or ArmFleet()
+        self.draw = draw
+        self.estimator = estimator or DrawEstimator()
+        self.estimates = {}  # job_id -> predicted seconds, cleared when the model is refitted
+        self.queue = []
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.worker_task = None
+        self.draw_tasks = set()
+
+    def start(self):
+        if self.worker_task is None or self.worker_task.done():
+            self.fleet.start()
+            self.worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        tasks = list(self.draw_tasks)
+        if self.worker_task is not None:
+            tasks.append(self.worker_task)
+            self.worker_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.fleet.stop()
+
+    def running(self):
+        """Return the jobs being drawn right now."""
+        return [arm.current for arm in self.fleet.arms if arm.current is not None]
+
+    def find(self, job_id):
+        """The queued or running entry of a job, None if it is neither."""
+        for entry in self.running() + self.queue:
+            if entry.job.job_id == job_id:
+                return entry
+        return None
+
+    def submit(self, job, notify, priority=0):
+        """Queue a job and return its 1-based position (1 = next to draw).
+
+        Returns None, queueing nothing, if the job is already queued or being drawn.
+        """
+        if self.find(job.job_id) is not None:
+            return None
+        entry = QueuedDraw(job, notify, priority, next(self.seq))
+        self.queue.append(entry)
+        self.queue.sort(key=lambda e: e.order)
+        self.wakeup.set()
+        return self.queue.index(entry) + 1
+
+    def estimate(self, entry):
+        """Predicted drawing time of a queued or running entry in seconds."""
+        seconds = self.estimates.get(entry.job.job_id)
+        if seconds is None:
+            seconds = self.estimates[entry.job.job_id] = self.estimator.estimate(entry.points)['total']
+        return seconds
+
+    def eta(self, job_id):
+        """Seconds until the given queued job starts drawing."""
+        # When each online arm frees up, assuming offline ones stay offline unless all are
+        arms = [arm for arm in self.fleet.arms if arm.healthy] or self.fleet.arms
+        free = []
+        for arm in arms:
+            if arm.current is None:
+                free.append(0.0)
+            else:
+                elapsed = time.time() - arm.current.started
+                free.append(max(self.estimate(arm.current) - elapsed, 0.0))
+        heapq.heapify(free)
+
+        for entry in self.queue:
+            start = heapq.heappop(free)
+            if entry.job.job_id == job_id:
+                return start
+            heapq.heappush(free, start + self.estimate(entry))
+        return None
+
+    def list(self):
+        """Return (position, entry) pairs for every queued job."""
+        return list(enumerate(self.queue, start=1))
+
+    def cancel(self, user_id):
+        """Remove the user's queued jobs. Returns how many were removed."""
+        removed = [e for e in self.queue if e.job.user_id == user_id]
+        self.queue = [e for e in self.queue if e.job.user_id != user_id]
+        return len(removed)
+
+    async def _worker(self):
+        while True:
+            arm = self.fleet.pick() if self.queue else None
+            if arm is None:
+                # Woken by new jobs and finished drawings; offline arms are rechecked now and then
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), ARM_RECHECK_INTERVAL if self.queue else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entry = self.queue.pop(0)
+            arm.begin(entry)
+            task = asyncio.create_task(self._draw(arm, entry))
+            self.draw_tasks.add(task)
+            task.add_done_callback(self.draw_tasks.discard)
+
+    async def _draw(self, arm, entry):
+        entry.started = time.time()
+        entry.arm = arm
+        ok = False
+        timings = None
+        try:
+            points = self.fleet.points_for(arm, entry.points)
+            await self._notify(entry, f"🖋️ Your drawing is starting now on {arm.name}!")
+            timings = await self.draw(points, sessao=arm.sessao)
+            ok = True
+        except asyncio.CancelledError:
+            raise
+        except ConnectionError as e:
+            log.warning("%s went offline while drawing job %s: %s", arm.name, entry.job.job_id, e)
+            entry.attempts += 1
+            if entry.attempts < len(self.fleet.arms):
+                # Another arm can start it over on a fresh sheet
+                entry.started = None
+                entry.arm = None
+                self.queue.insert(0, entry)
+                await self._notify(entry, f"⚠️ {arm.name} went offline. Your drawing goes to the next free arm.")
+            else:
+                await self._notify(entry, f"Sorry, I encountered an error while drawing: {str(e)}")
+        except Exception as e:
+            await self._notify(entry, f"Sorry, I encountered an error while drawing: {str(e)}")
+        finally:
+            arm.finish(ok)
+            if entry.arm is arm:
+                self.estimates.pop(entry.job.job_id, None)
+            self.wakeup.set()
+
+        # Past this point the drawing is done; nothing below may report it as failed
+        if not ok:
+            return
+        if timings:
+            try:
+                # Refine the motion model with how long each waypoint really took
+                self.estimator.record(points, timings)
+                self.estimates.clear()
+            except Exception as e:
+                log.warning("Could not record the timings of job %s: %s", entry.job.job_id, e)
+        await self._notify(entry, "Drawing completed successfully! What would you like to do next?")
+
+    async def _notify(self, entry, text):
+        """Message the job's owner; a failed message never affects the drawing."""
+        try:
+            await entry.notify(text)
+        except Exception as notify_error:
+            log.warning("Could not notify user %s: %s", entry.job.user_id, notify_error)
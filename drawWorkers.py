@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Worker pool settings
+PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', str(os.cpu_count() or 1)))
+PROCESS_QUEUE_SIZE = int(os.getenv('PROCESS_QUEUE_SIZE', '8'))  # Jobs running or waiting
+PROCESS_TIMEOUT = float(os.getenv('PROCESS_TIMEOUT', '300'))     # Seconds per job
+PROCESS_WARMUP = os.getenv('PROCESS_WARMUP', '1') != '0'         # Start the workers with the bot, not on the first job
+
+
+class QueueFullError(Exception):
+    """Raised when too many image jobs are already waiting for a worker."""
+
+
+class JobCancelledError(Exception):
+    """Raised when a user cancels their own image job."""
+
+
+class ProcessingPool:
+    """Run image processing jobs in worker processes, one tracked job per user."""
+
+    def __init__(self, workers=PROCESS_WORKERS, queue_size=PROCESS_QUEUE_SIZE, timeout=PROCESS_TIMEOUT,
+                 initializer=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.initializer = initializer  # Runs once in each worker as it starts
+        self.executor = None
+        self.jobs = {}         # user_id -> (awaited future, executor future) of the job being processed
+        self.cancelled = set() # futures cancelled on request of their user
+        self.abandoned = set() # executor futures nobody waits for that still keep a worker busy
+
+    def _get_executor(self):
+        if self.executor is None:
+            # Spawned workers do not inherit the bot's event loop or network threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=self.initializer
+            )
+        return self.executor
+
+    async def start(self):
+        """Start the workers now instead of on the first job. Returns the seconds until they answered."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        executor = self._get_executor()
+        # Each submission starts another worker while none is idle, and a worker
+        # only picks up work once its initializer has finished
+        await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self.workers)))
+        return loop.time() - started
+
+    @property
+    def depth(self):
+        """Jobs running or waiting, including abandoned ones still holding a worker."""
+        return len(self.jobs) + len(self.abandoned)
+
+    def _abandon(self, work):
+        """Stop waiting for a job, dropping it if it has not started yet.
+
+        A job already running cannot be stopped in its worker, so it keeps
+        counting towards the queue until it finishes.
+        """
+        if work.cancel():
+            return
+        self.abandoned.add(work)
+        work.add_done_callback(self.abandoned.discard)
+
+    async def run(self, user_id, func, **kwargs):
+        """Run func(**kwargs) in a worker and wait for its result."""
+        if self.depth >= self.queue_size:
+            raise QueueFullError("Too many images are being processed right now. Please try again in a moment.")
+
+        # A user only ever has one job in flight; a new one replaces the old
+        self.cancel(user_id)
+
+        work = self._get_executor().submit(functools.partial(func, **kwargs))
+        future = asyncio.wrap_future(work)
+        self.jobs[user_id] = (future, work)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.CancelledError:
+            if future in self.cancelled:
+                raise JobCancelledError("Processing cancelled.")
+            raise
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Processing took longer than {self.timeout:.0f}s, so I stopped waiting for it.")
+        finally:
+            self.cancelled.discard(future)
+            if not work.done():
+                self._abandon(work)
+            if self.jobs.get(user_id, (None,))[0] is future:
+                del self.jobs[user_id]
+
+    def cancel(self, user_id):
+        """Cancel the user's job. Returns True if there was one.
+
+        Jobs still waiting for a worker are dropped; a job already running
+        finishes in its worker, still counted in `depth`, but its result is
+        discarded.
+        """
+        future, work = self.jobs.pop(user_id, (None, None))
+        if future is None:
+            return False
+        self.cancelled.add(future)
+        future.cancel()
+        self._abandon(work)
+        return True
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.abandoned.clear()
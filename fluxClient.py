@@ -0,0 +1,105 @@
+import asyncio
+import os
+import httpx
+from dotenv import load_dotenv
+from metrics import API_ERRORS, track_api
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Hugging Face FLUX.1-dev endpoint (point it at a local stub for testing)
+FLUX_API_URL = os.getenv('FLUX_API_URL', 'https://router.huggingface.co/hf-inference/models/black-forest-labs/FLUX.1-dev')
+FLUX_TIMEOUT = float(os.getenv('FLUX_TIMEOUT', '120'))        # Seconds per request
+FLUX_RETRIES = int(os.getenv('FLUX_RETRIES', '4'))            # Extra attempts on 429/503 or network errors
+FLUX_BACKOFF = float(os.getenv('FLUX_BACKOFF', '2'))          # First retry delay, doubled per attempt
+FLUX_MAX_BACKOFF = float(os.getenv('FLUX_MAX_BACKOFF', '60'))
+FLUX_CONCURRENCY = int(os.getenv('FLUX_CONCURRENCY', '2'))    # Generations in flight across all users
+
+# Status codes Hugging Face returns while the model is loading or rate limited
+RETRY_STATUS = {429, 503}
+
+
+class ImageGenerationError(Exception):
+    """Raised when the image API fails or keeps refusing the request."""
+
+
+class FluxClient:
+    """Async client for the FLUX image API with a shared connection pool."""
+
+    def __init__(self, api_key, url=FLUX_API_URL, timeout=FLUX_TIMEOUT, retries=FLUX_RETRIES,
+                 backoff=FLUX_BACKOFF, concurrency=FLUX_CONCURRENCY, transport=None):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.transport = transport  # httpx transport to use instead of the network, e.g. httpx.MockTransport
+        self.client = None
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout, connect=10),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self.transport
+            )
+        return self.client
+
+    def _retry_delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt, honouring the server's hints."""
+        delay = self.backoff * 2 ** attempt
+        if response is not None:
+            try:
+                # Hugging Face reports how long the model needs to load
+                delay = float(response.json().get('estimated_time', delay))
+            except (ValueError, AttributeError):
+                pass
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+        return min(delay, FLUX_MAX_BACKOFF)
+
+    async def generate(self, prompt):
+        """Generate an image for the prompt and return its bytes."""
+        async with self.semaphore:
+            client = self._get_client()
+            for attempt in range(self.retries + 1):
+                last_attempt = attempt == self.retries
+                try:
+                    with track_api('flux'):
+                        response = await client.post(self.url, json={"inputs": prompt})
+                except httpx.TimeoutException as e:
+                    if last_attempt:
+                        raise ImageGenerationError("Image generation timed out. Please try again later.") from e
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                except httpx.TransportError as e:
+                    if last_attempt:
+                        raise ImageGenerationError(f"Could not reach the image API: {e}") from e
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+
+                if response.status_code == 200:
+                    return response.content
+                API_ERRORS.inc(api='flux')
+
+                if response.status_code in RETRY_STATUS and not last_attempt:
+                    await asyncio.sleep(self._retry_delay(attempt, response))
+                    continue
+
+                error_message = f"API Error: {response.status_code}"
+                try:
+                    error_data = response.json()
+                    if "error" in error_data:
+                        error_message = f"Image generation failed: {error_data['error']}"
+                except (ValueError, TypeError):
+                    pass
+                raise ImageGenerationError(error_message)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,190 @@
+"""
+Offline load test of the Telegram front end.
+
+Builds the bot's Application with a Bot that answers every API call
+locally after a fixed delay, and replaces Groq with a stand-in of fixed
+latency. Simulated users then go through /start, a few chat messages,
+/queue and /help, each waiting for the bot to finish one update before
+sending the next, like a person would. Reports updates per second and
+the reply latency percentiles, per update processing mode:
+
+    python loadTest.py --users 50 --messages 5 --llm-latency 0.5 --modes concurrent,sequential
+
+Nothing reaches Telegram, Groq or the arm.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+# Keep the bot's clients and stores offline before it is imported
+os.environ.setdefault('GROQ_API_KEY', 'offline')
+os.environ['SESSION_DB'] = ''
+os.environ['METRICS_PORT'] = '0'
+os.environ['METRICS_FILE'] = ''
+
+import numpy as np
+from telegram import Update
+from telegram.ext import ExtBot, SimpleUpdateProcessor
+import chatbotAI
+from updateProcessor import PerUserUpdateProcessor, UPDATE_MAX_IN_FLIGHT
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'DrawUFPB', 'username': 'drawufpb_bot'}
+REPLY_ENDPOINTS = {'sendMessage', 'sendPhoto', 'sendMediaGroup', 'editMessageText'}
+
+
+class OfflineBot(ExtBot):
+    """Bot whose API calls are answered locally after `latency` seconds, recording when replies were sent."""
+
+    def __init__(self, latency):
+        super().__init__('0:offline')
+        with self._unfrozen():
+            self.latency = latency
+            self.replies = {}  # chat_id -> times of the messages sent to it
+            self.message_ids = iter(range(1, 10 ** 9))
+
+    def _message(self, data):
+        chat_id = int(data['chat_id'])
+        return {'message_id': next(self.message_ids), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER, 'text': data.get('text', '')}
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        if endpoint == 'getMe':
+            return BOT_USER
+        await asyncio.sleep(self.latency)
+        if endpoint in REPLY_ENDPOINTS:
+            self.replies.setdefault(int(data['chat_id']), []).append(time.perf_counter())
+        if endpoint == 'sendMediaGroup':
+            return [self._message(data) for _ in data['media']]
+        if endpoint in REPLY_ENDPOINTS:
+            return self._message(data)
+        return True
+
+
+class OfflineGroq:
+    """Stand-in for the Groq client that answers after a fixed delay."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        reply = SimpleNamespace(content=f"Reply to: {kwargs['messages'][-1]['content']}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=reply)])
+
+
+def _tracked(processor_class):
+    """Subclass of an update processor that signals when each update is done."""
+    class Tracked(processor_class):
+        done = {}  # update_id -> future set once the update has been handled
+
+        async def do_process_update(self, update, coroutine):
+            try:
+                await super().do_process_update(update, coroutine)
+            finally:
+                future = self.done.pop(update.update_id, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+    return Tracked
+
+
+def _message_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def script(messages):
+    """What every simulated user sends, in order."""
+    return ['/start'] + [f'Tell me about drawing #{i}' for i in range(messages)] + ['/queue', '/help']
+
+
+async def run_mode(mode, users, messages, llm_latency, api_latency, in_flight):
+    """
+    Drive the handlers with every simulated user at once in one processing mode.
+
+    Returns:
+        dict: Update count, wall time, updates per second and reply latency percentiles
+    """
+    if mode == 'sequential':
+        processor = _tracked(SimpleUpdateProcessor)(1)
+    else:
+        processor = _tracked(PerUserUpdateProcessor)(max_in_flight=in_flight)
+
+    bot = OfflineBot(api_latency)
+    chatbotAI.groq_client = OfflineGroq(llm_latency)
+    application = chatbotAI.build_application(bot=bot, update_processor=processor)
+    update_ids = iter(range(1, 10 ** 9))
+    latencies = []
+
+    async def user(user_id):
+        for text in script(messages):
+            update_id = next(update_ids)
+            done = asyncio.get_running_loop().create_future()
+            processor.done[update_id] = done
+            sent = time.perf_counter()
+            await application.update_queue.put(Update.de_json(_message_update(update_id, user_id, text), bot))
+            await done
+            replies = [t for t in bot.replies.get(user_id, []) if t >= sent]
+            if replies:
+                latencies.append(replies[0] - sent)
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(1000 + i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    count = users * len(script(messages))
+    result = {
+        'mode': mode,
+        'users': users,
+        'updates': count,
+        'seconds': elapsed,
+        'updates_per_second': count / elapsed,
+        'replies': len(latencies),
+    }
+    if latencies:
+        result.update({f'p{q}_latency': float(np.percentile(latencies, q)) for q in (50, 90, 99)})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bot handlers offline with synthetic updates.')
+    parser.add_argument('--users', type=int, default=50, help='Simulated users chatting at the same time')
+    parser.add_argument('--messages', type=int, default=5, help='Chat messages per user')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds the simulated Groq takes to answer')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='Seconds per simulated Telegram API call')
+    parser.add_argument('--in-flight', type=int, default=UPDATE_MAX_IN_FLIGHT,
+                        help='Updates handled at once in concurrent mode')
+    parser.add_argument('--modes', default='concurrent', help='Comma separated: concurrent, sequential')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        result = asyncio.run(run_mode(mode, args.users, args.messages, args.llm_latency,
+                                      args.api_latency, args.in_flight))
+        results.append(result)
+        print(f"{mode:<11} {result['updates']} updates in {result['seconds']:.1f}s = "
+              f"{result['updates_per_second']:.1f}/s, reply latency p50 {result.get('p50_latency', 0):.2f}s "
+              f"p90 {result.get('p90_latency', 0):.2f}s p99 {result.get('p99_latency', 0):.2f}s")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Runtime metrics and logging for the bot.
+
+Counters, gauges and histograms are kept in memory and rendered in the
+Prometheus text format, either served on a local HTTP port (METRICS_PORT)
+or written to a file at a fixed interval (METRICS_FILE). Each process has
+its own registry, so the processing workers report their step timings back
+to the bot instead of exporting them.
+
+Logging goes through the standard logging module. event() writes one
+key=value line per occurrence, and RateLimitedLogger keeps chatty loops,
+like the arm position polling, from flooding the output.
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))       # Serve /metrics on 127.0.0.1:PORT, 0 to disable
+METRICS_FILE = os.getenv('METRICS_FILE', '')             # Write the metrics to this file, empty to disable
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', '60'))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# Seconds, from a fast handler up to a full drawing pipeline
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{_format_labels(self.label_names, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. of handled requests or failures."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Current value, either set directly or read from `function` when rendered.
+
+    For a gauge with labels, `function` returns a dict mapping tuples of
+    label values to values.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            self.values = value if self.label_names else {(): value}
+        yield from super().samples()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over cumulative buckets, plus their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_sum', key, (), total
+            yield f'{self.name}_count', key, (), cumulative
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Metrics shared by every module
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Time spent in a Telegram handler', ('handler',))
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Telegram handlers that raised', ('handler',))
+API_SECONDS = Histogram('external_api_seconds', 'Latency of calls to external APIs', ('api',))
+API_ERRORS = Counter('external_api_errors_total', 'Failed calls to external APIs', ('api',))
+
+
+def track_handler(handler):
+    """Decorate an async Telegram handler to record its latency and failures."""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=handler.__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=handler.__name__)
+    return wrapper
+
+
+@contextmanager
+def track_api(api):
+    """Time a call to an external API and count it as failed if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        API_ERRORS.inc(api=api)
+        raise
+    finally:
+        API_SECONDS.observe(time.perf_counter() - started, api=api)
+
+
+def setup_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+def event(logger, name, level=logging.INFO, **fields):
+    """Log a structured event as `name key=value ...`."""
+    if logger.isEnabledFor(level):
+        logger.log(level, '%s %s', name, ' '.join(f'{key}={value}' for key, value in fields.items()))
+
+
+class RateLimitedLogger:
+    """Let through at most one message per key every `interval` seconds.
+
+    The next message that gets through says how many were dropped.
+    """
+
+    def __init__(self, logger, interval=1.0):
+        self.logger = logger
+        self.interval = interval
+        self.last = {}
+        self.suppressed = {}
+
+    def log(self, level, key, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        if now - self.last.get(key, -math.inf) < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return
+        self.last[key] = now
+        dropped = self.suppressed.pop(key, 0)
+        if dropped:
+            msg = f'{msg} ({dropped} similar messages suppressed)'
+        self.logger.log(level, msg, *args)
+
+    def debug(self, key, msg, *args):
+        self.log(logging.DEBUG, key, msg, *args)
+
+    def info(self, key, msg, *args):
+        self.log(logging.INFO, key, msg, *args)
+
+    def warning(self, key, msg, *args):
+        self.log(logging.WARNING, key, msg, *args)
+
+
+async def _serve_request(reader, writer):
+    try:
+        # Any GET gets the metrics; read and ignore the request headers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = render().encode()
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'Connection: close\r\n\r\n' + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def dump(path):
+    """Write the metrics to a file, replacing it in one step."""
+    staging = f'{path}.tmp'
+    with open(staging, 'w') as f:
+        f.write(render())
+    os.replace(staging, path)
+
+
+async def _dump_periodically(path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        dump(path)
+
+
+class MetricsExporter:
+    """Expose the metrics over HTTP and/or in a file, as configured."""
+
+    def __init__(self, port=METRICS_PORT, path=METRICS_FILE, interval=METRICS_DUMP_INTERVAL):
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self.dump_task = None
+
+    async def start(self):
+        if self.port:
+            self.server = await asyncio.start_server(_serve_request, '127.0.0.1', self.port)
+        if self.path:
+            self.dump_task = asyncio.create_task(_dump_periodically(self.path, self.interval))
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.dump_task is not None:
+            self.dump_task.cancel()
+            self.dump_task = None
+            dump(self.path)  # Keep the final values
@@ -0,0 +1,333 @@
+"""
+Path post-processing for robotic drawing.
+
+Works on the 6-axis point lists produced by AmericoDraws ([x, y, z, a, e, r]),
+where pen-down points sit at the drawing height and pen-up points are offset
+by z_up.
+"""
+
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+PEN_UP_SPEED = float(os.getenv('PEN_UP_SPEED', '50'))  # mm/s while travelling with the pen up
+LIFT_TIME = float(os.getenv('LIFT_TIME', '4'))         # Seconds per lift (raise + lower, with settling)
+ARM_RESOLUTION = float(os.getenv('ARM_RESOLUTION', '1'))              # mm the arm can actually resolve
+COLLINEAR_TOLERANCE = float(os.getenv('COLLINEAR_TOLERANCE', '0.5'))  # mm a dropped point may deviate from the path
+KDTREE_MIN_STROKES = 256   # Use a KD-tree for nearest-neighbour search above this many strokes
+TWO_OPT_MAX_STROKES = 3000 # Skip 2-opt above this many strokes
+TWO_OPT_MAX_PASSES = 20
+
+
+def split_strokes(points):
+    """
+    Split a path into its pen-down strokes.
+
+    Args:
+        points (list): Path as a list of [x, y, z, a, e, r] points
+
+    Returns:
+        tuple: List of strokes (lists of pen-down points) and the pen-up z offset
+    """
+    if not points:
+        return [], 0
+
+    # Same convention as AmericoDraws.visualization: the first point is pen down
+    # and any point further from the table (larger |z|) is pen up
+    base_z = abs(points[0][2])
+    strokes = []
+    current = []
+    z_up = 0
+    for point in points:
+        if abs(point[2]) > base_z:
+            z_up = point[2] - points[0][2]
+            if current:
+                strokes.append(current)
+                current = []
+        else:
+            current.append(point)
+    if current:
+        strokes.append(current)
+
+    return strokes, z_up
+
+
+def join_strokes(strokes, z_up, distance_threshold):
+    """
+    Build a path from ordered strokes, lifting the pen between distant ones.
+
+    Mirrors the pen up/down rules of AmericoDraws.path_planning.create_points_array.
+    """
+    path = []
+    for stroke in strokes:
+        if path:
+            last = path[-1]
+            first = stroke[0]
+            if np.hypot(first[0] - last[0], first[1] - last[1]) > distance_threshold:
+                path.append([last[0], last[1], last[2] + z_up, last[3], last[4], last[5]])
+                path.append([first[0], first[1], first[2] + z_up, first[3], first[4], first[5]])
+        path.extend(stroke)
+
+    # Make sure we end with pen up
+    if path:
+        last = path[-1]
+        path.append([last[0], last[1], last[2] + z_up, last[3], last[4], last[5]])
+
+    # Remove duplicate consecutive points
+    result = []
+    for point in path:
+        if not result or point != result[-1]:
+            result.append(point)
+    return result
+
+
+def path_stats(points):
+    """
+    Measure pen-up travel of a path.
+
+    Returns:
+        dict: Pen-up travel length in mm and number of pen lifts
+    """
+    if len(points) < 2:
+        return {'pen_up_travel': 0.0, 'lifts': 0}
+
+    array = np.asarray(points, dtype=float)
+    up = np.abs(array[:, 2]) > abs(array[0, 2])
+    steps = np.hypot(np.diff(array[:, 0]), np.diff(array[:, 1]))
+
+    # A move is pen-up travel when both of its ends are up
+    travel = steps[up[:-1] & up[1:]].sum()
+    lifts = int(np.count_nonzero(up[1:] & ~up[:-1]))
+    return {'pen_up_travel': float(travel), 'lifts': lifts}
+
+
+def _segment_distances(points, start, end):
+    """Distance of each xy point to the segment from start to end."""
+    chord = end - start
+    length_sq = chord @ chord
+    if length_sq == 0:
+        return np.hypot(*(points - start).T)
+    along = np.clip((points - start) @ chord / length_sq, 0, 1)
+    return np.hypot(*(points - (start + along[:, None] * chord)).T)
+
+
+def _douglas_peucker(xy, tolerance):
+    """Keep mask of a polyline whose dropped points all lie within tolerance of the kept segment spanning them."""
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, len(xy) - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        distances = _segment_distances(xy[first + 1:last], xy[first], xy[last])
+        worst = int(np.argmax(distances))
+        if distances[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            spans.extend([(first, split), (split, last)])
+    return keep
+
+
+def _pen_down_runs(array):
+    """(start, end) index pairs, end exclusive, of consecutive pen-down points."""
+    down = np.abs(array[:, 2]) <= abs(array[0, 2])
+    edges = np.diff(np.concatenate([[0], down.astype(np.int8), [0]]))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+def simplify_path(points, upper_left_edge, bottom_right_edge,
+                  resolution=ARM_RESOLUTION, tolerance=COLLINEAR_TOLERANCE):
+    """
+    Decimate a path before it is sent to the arm.
+
+    Clamps x/y to the workspace, then drops pen-down points so that every
+    dropped point stays within `tolerance` of the simplified path, measured
+    against the original points of its stroke (not against points already
+    merged). Kept points closer together than the arm resolution are
+    dropped too, under the same bound. Stroke endpoints and pen up/down
+    moves are always kept, and points are only ever removed, never moved,
+    so for whole-mm input (what the pipeline produces) the bound holds
+    exactly after the final rounding.
+
+    Args:
+        points (list): Path as a list of [x, y, z, a, e, r] points
+        upper_left_edge (list): Upper left edge coordinates [x, y, z, a, e, r]
+        bottom_right_edge (list): Bottom right edge coordinates [x, y, z, a, e, r]
+        resolution (float): Spacing in mm below which kept pen-down points are merged when the bound allows
+        tolerance (float): Maximum distance in mm of a dropped point from the path that replaces it
+
+    Returns:
+        tuple: Simplified path and a report with the point counts before and after
+    """
+    report = {'points_before': len(points), 'points_after': len(points)}
+    if not points:
+        return points, report
+
+    array = np.asarray(points, dtype=float)
+
+    # Clamp to the calibrated workspace
+    corners = np.array([upper_left_edge[:2], bottom_right_edge[:2]], dtype=float)
+    array[:, :2] = np.clip(array[:, :2], corners.min(axis=0), corners.max(axis=0))
+
+    keep = np.ones(len(array), dtype=bool)
+    for start, end in _pen_down_runs(array):
+        if end - start < 3:
+            continue
+        xy = array[start:end, :2]
+        kept = np.flatnonzero(_douglas_peucker(xy, tolerance))
+
+        # Merge kept points the arm cannot tell apart, if the originals they span stay within tolerance
+        if resolution > 0:
+            merged = [kept[0]]
+            for i, following in zip(kept[1:-1], kept[2:]):
+                anchor = merged[-1]
+                if (np.hypot(*(xy[i] - xy[anchor])) < resolution
+                        and _segment_distances(xy[anchor + 1:following], xy[anchor], xy[following]).max() <= tolerance):
+                    continue
+                merged.append(i)
+            merged.append(kept[-1])
+            kept = merged
+
+        keep[start:end] = False
+        keep[start + np.asarray(kept)] = True
+
+    simplified = np.rint(array[keep]).astype(int).tolist()
+
+    # Clamping and rounding can create repeated points
+    result = []
+    for point in simplified:
+        if not result or point != result[-1]:
+            result.append(point)
+
+    report['points_after'] = len(result)
+    return result, report
+
+
+def _nearest_neighbour_order(starts, ends, origin):
+    """Greedy stroke order; returns stroke indices and whether each is reversed."""
+    n = len(starts)
+    endpoints = np.vstack([starts, ends])  # Row i: start of stroke i, row n + i: its end
+    used = np.zeros(n, dtype=bool)
+    order = []
+    reversed_flags = []
+    position = origin
+
+    tree = None
+    if n > KDTREE_MIN_STROKES:
+        from scipy.spatial import cKDTree  # Slow to import and not needed for small drawings
+        tree = cKDTree(endpoints)
+    for _ in range(n):
+        if tree is not None:
+            # Widen the query until an endpoint of an unused stroke turns up
+            k = 8
+            while True:
+                _, candidates = tree.query(position, k=min(k, 2 * n))
+                candidates = np.atleast_1d(candidates)
+                free = candidates[~used[candidates % n]]
+                if len(free) or k >= 2 * n:
+                    break
+                k *= 4
+            best = int(free[0])
+        else:
+            distances = np.hypot(*(endpoints - position).T)
+            distances[np.concatenate([used, used])] = np.inf
+            best = int(np.argmin(distances))
+
+        stroke = best % n
+        is_reversed = best >= n
+        used[stroke] = True
+        order.append(stroke)
+        reversed_flags.append(is_reversed)
+        position = starts[stroke] if is_reversed else ends[stroke]
+
+    return np.array(order), np.array(reversed_flags)
+
+
+def _two_opt(entries, exits):
+    """
+    Improve an ordering by reversing blocks of strokes (2-opt).
+
+    `entries`/`exits` hold the point where each stroke in the current order is
+    entered and left. Returns the improved arrays plus the block reversals
+    applied, as a permutation and a flip mask relative to the input order.
+    """
+    n = len(entries)
+    perm = np.arange(n)
+    flipped = np.zeros(n, dtype=bool)
+    for _ in range(TWO_OPT_MAX_PASSES):
+        improved = False
+        for i in range(1, n):
+            # Reversing strokes i..j turns b[i-1] -> a[i] ... b[j] -> a[j+1]
+            # into b[i-1] -> b[j] ... a[i] -> a[j+1]; the path end has no a[j+1]
+            j = np.arange(i, n)
+            following = entries[np.minimum(j + 1, n - 1)]
+            has_next = (j < n - 1)
+            before = (np.hypot(*(exits[i - 1] - entries[i]))
+                      + np.hypot(*(exits[j] - following).T) * has_next)
+            after = (np.hypot(*(exits[i - 1] - exits[j]).T)
+                     + np.hypot(*(entries[i] - following).T) * has_next)
+            gain = before - after
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                j = int(j[best])
+                entries[i:j + 1], exits[i:j + 1] = exits[i:j + 1][::-1].copy(), entries[i:j + 1][::-1].copy()
+                perm[i:j + 1] = perm[i:j + 1][::-1].copy()
+                flipped[i:j + 1] = ~flipped[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return perm, flipped
+
+
+def optimize_stroke_order(points, distance_threshold=3):
+    """
+    Reorder and reverse strokes to minimise pen-up travel and lifts.
+
+    Args:
+        points (list): Path as produced by independencia_ou_morte
+        distance_threshold (float): Gap below which strokes are joined without lifting the pen
+
+    Returns:
+        tuple: Optimized path and a report with before/after travel, lifts and time saved
+    """
+    strokes, z_up = split_strokes(points)
+    before = path_stats(points)
+
+    if len(strokes) > 1:
+        starts = np.array([s[0][:2] for s in strokes], dtype=float)
+        ends = np.array([s[-1][:2] for s in strokes], dtype=float)
+
+        # Start where the original path started
+        order, reversed_flags = _nearest_neighbour_order(starts, ends, starts[0])
+        entries = np.where(reversed_flags[:, None], ends[order], starts[order])
+        exits = np.where(reversed_flags[:, None], starts[order], ends[order])
+
+        if len(strokes) <= TWO_OPT_MAX_STROKES:
+            perm, flipped = _two_opt(entries, exits)
+            order = order[perm]
+            reversed_flags = reversed_flags[perm] ^ flipped
+
+        ordered = [strokes[i][::-1] if rev else strokes[i] for i, rev in zip(order, reversed_flags)]
+        optimized = join_strokes(ordered, z_up, distance_threshold)
+        after = path_stats(optimized)
+
+        # Never hand back a path that is worse than the original
+        if (after['pen_up_travel'], after['lifts']) > (before['pen_up_travel'], before['lifts']):
+            optimized, after = points, before
+    else:
+        optimized, after = points, before
+
+    saved = ((before['pen_up_travel'] - after['pen_up_travel']) / PEN_UP_SPEED
+             + (before['lifts'] - after['lifts']) * LIFT_TIME)
+    report = {
+        'travel_before': before['pen_up_travel'],
+        'travel_after': after['pen_up_travel'],
+        'lifts_before': before['lifts'],
+        'lifts_after': after['lifts'],
+        'time_saved': saved,
+    }
+    return optimized, report
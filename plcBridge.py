@@ -1,74 +1,447 @@
-from socket import *
-import sys
-import time
+import asyncio
+from collections import deque
 from dotenv import load_dotenv
+import logging
+import numpy as np
 import os
+import time
+from metrics import Counter, Histogram, RateLimitedLogger, event
+from drawJobFile import read_job, save_progress, clear_progress
 
 # Load variables from .env into the environment
 load_dotenv()
 
 # Access the variables
 CLP_IP = os.getenv('CLP_IP')
+CLP_PORT = int(os.getenv('CLP_PORT', '2000'))
+
+# Link timeouts (seconds)
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', '10'))
+
+# Streaming motion settings
+STREAM_MODE = os.getenv('STREAM_MODE', '0') == '1'            # 1 = streamed moves, not yet validated on the real CLP
+STREAM_WINDOW = int(os.getenv('STREAM_WINDOW', '4'))          # Waypoints in flight to the CLP
+ARRIVAL_TOLERANCE = int(os.getenv('ARRIVAL_TOLERANCE', '1'))  # Max per-axis error to count as arrived
+SETTLE_TIME = float(os.getenv('SETTLE_TIME', '2'))            # Pause at pen-up/pen-down transitions
+STREAM_STALL_TIMEOUT = float(os.getenv('STREAM_STALL_TIMEOUT', '30'))  # Max seconds without reaching the next waypoint
+
+# Session keep-alive and reconnect settings
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', '15'))  # Idle time between position checks
+RECONNECT_ATTEMPTS = int(os.getenv('RECONNECT_ATTEMPTS', '5'))
+RECONNECT_DELAY = float(os.getenv('RECONNECT_DELAY', '1'))         # First backoff step, doubled per attempt
+RECONNECT_MAX_DELAY = float(os.getenv('RECONNECT_MAX_DELAY', '30'))
+
+Ponto_inicial = [170, 65, -100, -3, 88, -2]
+
+TAMANHO_QUADRO = 16   # Bytes per position frame sent by the CLP
+LEITURA_MAX = 65536   # Max bytes pulled from the socket per read
+DRENO_ESPERA = 0.001  # Seconds a follow-up read waits before the socket counts as drained
+PROGRESSO_A_CADA = 25  # Waypoints between progress saves when drawing a job file
+
+log = logging.getLogger('plcBridge')
+log_posicao = RateLimitedLogger(log, interval=1.0)  # Position polling runs many times per second
+
+WAYPOINT_SECONDS = Histogram('arm_waypoint_seconds', 'Time between consecutive acknowledged waypoints',
+                             buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 30))
+SETTLE_SECONDS = Histogram('arm_settle_seconds', 'Pauses for the arm to settle', ('motivo',),
+                           buckets=(0.1, 0.5, 1, 2, 3, 5))
+DRAW_SECONDS = Histogram('arm_draw_seconds', 'Duration of whole drawings', ('resultado',),
+                         buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+WAYPOINTS = Counter('arm_waypoints_total', 'Waypoints acknowledged by the arm')
+RECONNECTS = Counter('arm_reconnects_total', 'Links to the CLP dropped during a drawing or heartbeat')
+
+def montar_comando(garra, lista):
+    """Build a move command: 1-byte gripper flag followed by 4-byte signed axes."""
+    flag = garra.to_bytes(1, byteorder="big")
+    POS_DO_COMPONENTE = [i.to_bytes(4, byteorder="big", signed=True) for i in lista]
+    return flag + b''.join(POS_DO_COMPONENTE)
+
+def decodificar_quadro(dadosbraco):
+    """Decode one 16-byte position frame into the six axes."""
+    A = int.from_bytes(dadosbraco[1:4],   byteorder="big", signed=True)
+    B = int.from_bytes(dadosbraco[4:7],   byteorder="big", signed=True)
+    C = int.from_bytes(dadosbraco[7:10],  byteorder="big", signed=True)
+    D = int.from_bytes(dadosbraco[10:12], byteorder="big", signed=True)
+    E = int.from_bytes(dadosbraco[12:14], byteorder="big", signed=True)
+    F = int.from_bytes(dadosbraco[14:16], byteorder="big", signed=True)
+    return [A, B, C, D, E, F]
+
+def decodificar_quadros(dados):
+    """Decode a run of whole 16-byte frames at once into an (n, 6) int array."""
+    quadros = np.frombuffer(dados, dtype=np.uint8).reshape(-1, TAMANHO_QUADRO).astype(np.int32)
+
+    # A, B and C are 3-byte signed big-endian fields
+    tres = quadros[:, 1:10].reshape(-1, 3, 3)
+    ABC = (tres[:, :, 0] << 16) | (tres[:, :, 1] << 8) | tres[:, :, 2]
+    ABC -= (ABC & 0x800000) << 1
+
+    # D, E and F are 2-byte signed big-endian fields
+    dois = quadros[:, 10:16].reshape(-1, 3, 2)
+    DEF = (dois[:, :, 0] << 8) | dois[:, :, 1]
+    DEF -= (DEF & 0x8000) << 1
+
+    return np.hstack([ABC, DEF])
+
+class LeitorQuadros:
+    """Reassemble position frames from arbitrary TCP chunks.
+
+    Bytes are appended to one bytearray and only whole frames are consumed, so
+    partial or coalesced reads never shift the field boundaries.
+    """
 
-class Conexao:
     def __init__(self):
+        self.buffer = bytearray()
+
+    def alimentar(self, dados):
+        self.buffer += dados
+
+    def pendentes(self):
+        return len(self.buffer) // TAMANHO_QUADRO
+
+    def quadros(self):
+        """Decode and consume every complete frame buffered so far."""
+        n = self.pendentes() * TAMANHO_QUADRO
+        with memoryview(self.buffer) as mv:
+            posicoes = decodificar_quadros(mv[:n])
+        del self.buffer[:n]
+        return posicoes
+
+class Conexao:
+    def __init__(self, host=None, port=None):
+        self.serverHost = host or CLP_IP  # IP do CLP
+        self.serverPort = port or CLP_PORT
+        self.reader = None
+        self.writer = None
+        self.leitor = LeitorQuadros()
+
+    async def connect(self, timeout=CONNECT_TIMEOUT):
+        log.info('Tentando conectar a %s:%s...', self.serverHost, self.serverPort)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.serverHost, self.serverPort), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"Erro na conexão com {self.serverHost}:{self.serverPort}: {e!r}") from e
+        log.info('Conexão realizada com %s', self.writer.get_extra_info('peername'))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
 
-        global CLP_IP
-        
-        self.serverHost = CLP_IP  # IP do CLP
-        self.serverPort = 2000
-        self.sockobj = socket(AF_INET, SOCK_STREAM)
+    async def publicar(self, garra, lista):
+        self.writer.write(montar_comando(garra, lista))
+        await self.writer.drain()
 
-    def connect(self):
-        print("Tentando conectar...")
+    async def _ler(self, timeout, drenando=False):
+        """Read what the socket has, up to LEITURA_MAX bytes, into the frame buffer.
+
+        Returns the number of bytes read. While `drenando`, running out of
+        time only means nothing else was buffered, and returns 0.
+        """
         try:
-            self.sockobj.connect((self.serverHost, self.serverPort))
-            print('Conexão realizada!')
-        except Exception as e:
-            print(f"Erro na conexão: {e}")
-            sys.exit()
-        print(self.sockobj.getpeername())
-
-    def publicar(self, garra, lista):
-        flag = garra.to_bytes(1, byteorder="big")
-        POS_DO_COMPONENTE = [i.to_bytes(4, byteorder="big", signed=True) for i in lista]
-        data = flag + b''.join(POS_DO_COMPONENTE)
-        self.sockobj.send(data)
-
-    def LER_POS(self):
-        dadosbraco = self.sockobj.recv(16)
-        A = int.from_bytes(dadosbraco[1:4],   byteorder="big", signed=True)
-        B = int.from_bytes(dadosbraco[4:7],   byteorder="big", signed=True)
-        C = int.from_bytes(dadosbraco[7:10],  byteorder="big", signed=True)
-        D = int.from_bytes(dadosbraco[10:12], byteorder="big", signed=True)
-        E = int.from_bytes(dadosbraco[12:14], byteorder="big", signed=True)
-        F = int.from_bytes(dadosbraco[14:16], byteorder="big", signed=True)
-        return [A, B, C, D, E, F]
-
-def mover_braco(clp, POS_MOV, msg):
-    clp.publicar(0, POS_MOV)
-    POS_ATUAL = clp.LER_POS()
-    print('Iniciando movimento.')
+            dadosbraco = await asyncio.wait_for(self.reader.read(LEITURA_MAX), timeout)
+        except asyncio.TimeoutError as e:
+            if drenando:
+                return 0
+            raise ConnectionError(f"Sem resposta do CLP em {timeout}s") from e
+        if not dadosbraco:
+            raise ConnectionError("CLP encerrou a conexão")
+        self.leitor.alimentar(dadosbraco)
+        return len(dadosbraco)
 
-    while POS_ATUAL[:-1] != POS_MOV[:-1] or abs(POS_ATUAL[-1]) != abs(POS_MOV[-1]):
-        POS_ATUAL = clp.LER_POS()
-        print(msg)
-        print(f'Posição desejada: {POS_MOV} || Posição atual: {POS_ATUAL}')
-    time.sleep(2)
+    async def LER_QUADROS(self, timeout=READ_TIMEOUT):
+        """Return every position received since the last read, oldest first, as an (n, 6) array.
 
-async def makeDraw(posicoes):
-    print('###############')
-    print(posicoes)
-    print(len(posicoes))
-    
-    clp = Conexao()
-    clp.connect()
+        Waits for at least one whole frame, then drains whatever else the
+        socket has buffered so the last row is the freshest position.
+        """
+        while True:
+            lidos = await self._ler(timeout)
+            # A read shorter than LEITURA_MAX emptied the stream's buffer. After a
+            # full one, buffered bytes come back at once and a brief wait means none are left.
+            while lidos == LEITURA_MAX:
+                lidos = await self._ler(DRENO_ESPERA, drenando=True)
+            if self.leitor.pendentes():
+                return self.leitor.quadros()
 
-    Ponto_inicial = [170, 65, -100, -3, 88, -2]
+    async def LER_POS(self, timeout=READ_TIMEOUT):
+        """Return the most recent position reported by the CLP."""
+        return (await self.LER_QUADROS(timeout))[-1].tolist()
 
-    mover_braco(clp, Ponto_inicial, msg="Indo para o ponto inicial")
+def chegou(POS_ATUAL, POS_MOV, tolerancia=0):
+    """Check whether the arm reached POS_MOV within the given tolerance."""
+    eixos = zip(POS_ATUAL[:-1] + [abs(POS_ATUAL[-1])], POS_MOV[:-1] + [abs(POS_MOV[-1])])
+    return all(abs(atual - alvo) <= tolerancia for atual, alvo in eixos)
 
+def segmentar(posicoes):
+    """Split the path into runs of constant height, separated by pen transitions."""
+    segmento = []
     for pos in posicoes:
-        mover_braco(clp, pos, msg="Movendo para posição acima do ponto")
+        if segmento and pos[2] != segmento[-1][2]:
+            yield segmento
+            segmento = []
+        segmento.append(pos)
+    if segmento:
+        yield segmento
+
+def _nada():
+    pass
+
+async def mover_braco(clp, POS_MOV, msg, confirmar=_nada):
+    await clp.publicar(0, POS_MOV)
+    POS_ATUAL = await clp.LER_POS()
+    log.debug('Iniciando movimento para %s', POS_MOV)
+
+    while POS_ATUAL[:-1] != POS_MOV[:-1] or abs(POS_ATUAL[-1]) != abs(POS_MOV[-1]):
+        POS_ATUAL = await clp.LER_POS()
+        log_posicao.debug('posicao', '%s. Posição desejada: %s || Posição atual: %s', msg, POS_MOV, POS_ATUAL)
+    confirmar()
+    with SETTLE_SECONDS.time(motivo='ponto'):
+        await asyncio.sleep(2)
+
+async def mover_stream(clp, posicoes, janela=STREAM_WINDOW, tolerancia=ARRIVAL_TOLERANCE, confirmar=_nada,
+                       limite=STREAM_STALL_TIMEOUT):
+    """Stream waypoints to the CLP keeping up to `janela` targets in flight.
+
+    `confirmar` is called once for every waypoint the arm acknowledges, in order.
+    Raises ConnectionError if the next waypoint is not seen within `limite`
+    seconds (a lost command, a blended corner, sparse frames...), so the
+    session reconnects and resends the rest instead of waiting forever.
+    """
+    pendentes = deque()
+    proximo = 0
+    avanco = time.monotonic()  # When the last waypoint was confirmed
+
+    while proximo < len(posicoes) or pendentes:
+        # Fill the window with upcoming waypoints
+        while proximo < len(posicoes) and len(pendentes) < janela:
+            await clp.publicar(0, posicoes[proximo])
+            pendentes.append(posicoes[proximo])
+            proximo += 1
+
+        # Check every frame received, not only the freshest, so a waypoint the
+        # arm passed between two reads is still seen. Targets are released
+        # strictly in order: a later waypoint lying close to the current
+        # position does not mean the arm already reached the ones before it.
+        for POS_ATUAL in (await clp.LER_QUADROS()).tolist():
+            while pendentes and chegou(POS_ATUAL, pendentes[0], tolerancia):
+                pendentes.popleft()
+                confirmar()
+                avanco = time.monotonic()
+
+        if pendentes and time.monotonic() - avanco > limite:
+            raise ConnectionError(f"Braço não alcançou {pendentes[0]} em {limite:.0f}s (posição {POS_ATUAL})")
+
+async def mover_continuo(clp, posicoes, janela=STREAM_WINDOW, tolerancia=ARRIVAL_TOLERANCE, espera=SETTLE_TIME,
+                         confirmar=_nada):
+    """Draw the path streaming each segment and settling only at pen transitions."""
+    for segmento in segmentar(posicoes):
+        # The first point of a segment is the vertical pen move itself
+        await mover_stream(clp, segmento[:1], 1, tolerancia, confirmar)
+        with SETTLE_SECONDS.time(motivo='caneta'):
+            await asyncio.sleep(espera)
+        await mover_stream(clp, segmento[1:], janela, tolerancia, confirmar)
+
+class SessaoCLP:
+    """CLP session of one arm: owns the link, keeps it alive and resumes jobs."""
+
+    def __init__(self, host=None, port=None, ponto_inicial=None):
+        self.host = host or CLP_IP
+        self.port = port or CLP_PORT
+        self.ponto_inicial = ponto_inicial or Ponto_inicial
+        self.clp = None
+        self.lock = asyncio.Lock()  # One job (or heartbeat) on the link at a time
+        self.heartbeat_task = None
+        self.ultimo_confirmado = -1  # Index of the last waypoint acknowledged in the current job
+        self.partida = None          # When the current job left the start point
+        self.tempos = []             # Seconds from `partida` until each waypoint was acknowledged
+        self.saudavel = True         # False after the link failed for good, until it answers again
+        self.ultimo_erro = None
+        self.ao_confirmar = None     # Callable(index) of the running drawing, see executar
+
+    async def conectar(self):
+        """Return the open link, reconnecting with exponential backoff if needed."""
+        if self.clp is not None:
+            return self.clp
+
+        atraso = RECONNECT_DELAY
+        for tentativa in range(1, RECONNECT_ATTEMPTS + 1):
+            clp = Conexao(self.host, self.port)
+            try:
+                await clp.connect()
+                self.clp = clp
+                return clp
+            except ConnectionError as e:
+                log.warning('Tentativa %d/%d falhou: %s', tentativa, RECONNECT_ATTEMPTS, e)
+                if tentativa < RECONNECT_ATTEMPTS:
+                    await asyncio.sleep(atraso)
+                    atraso = min(atraso * 2, RECONNECT_MAX_DELAY)
+        raise ConnectionError(f'CLP {self.host}:{self.port} indisponível após {RECONNECT_ATTEMPTS} tentativas')
+
+    async def descartar(self):
+        """Drop the current link so the next use reconnects."""
+        if self.clp is not None:
+            await self.clp.close()
+            self.clp = None
+
+    def iniciar_heartbeat(self):
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def encerrar(self):
+        """Stop the heartbeat and close the link."""
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+        await self.descartar()
+
+    def _marcar(self, erro=None):
+        """Record whether the last use of the link worked."""
+        self.saudavel = erro is None
+        self.ultimo_erro = None if erro is None else str(erro)
+
+    async def _heartbeat(self):
+        """Read a position while idle to detect stale links and reconnect early."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if self.lock.locked():
+                continue  # A running job already exercises the link
+            async with self.lock:
+                try:
+                    clp = await self.conectar()
+                    await clp.LER_POS()
+                    self._marcar()
+                except ConnectionError as e:
+                    log.warning('Heartbeat falhou, reconectando: %s', e)
+                    RECONNECTS.inc()
+                    self._marcar(e)
+                    await self.descartar()
+
+    def _confirmar(self):
+        self.ultimo_confirmado += 1
+        self.tempos.append(time.monotonic() - self.partida)
+        WAYPOINTS.inc()
+        WAYPOINT_SECONDS.observe(self.tempos[-1] - (self.tempos[-2] if len(self.tempos) > 1 else 0.0))
+        if self.ao_confirmar is not None:
+            self.ao_confirmar(self.ultimo_confirmado)
+
+    async def executar(self, posicoes, stream=STREAM_MODE, inicio=0, ao_confirmar=None):
+        """Draw `posicoes` from index `inicio`, resuming after link drops.
+
+        `ao_confirmar(index)` is called as each waypoint of this drawing is
+        acknowledged. Returns the waypoint timings (see `tempos`) of a whole
+        uninterrupted drawing, or None when they would not reflect the arm's speed.
+        """
+        self.iniciar_heartbeat()
+        async with self.lock:
+            # Set under the lock, so it only ever sees this drawing's waypoints
+            self.ao_confirmar = ao_confirmar
+            try:
+                return await self._executar(posicoes, stream, inicio)
+            finally:
+                self.ao_confirmar = None
+
+    async def _executar(self, posicoes, stream, inicio):
+        self.ultimo_confirmado = inicio - 1
+        self.tempos = []
+        em_casa = False
+        interrompido = inicio > 0
+        sem_progresso = 0
+        while True:
+            try:
+                clp = await self.conectar()
+            except ConnectionError as e:
+                self._marcar(e)
+                raise
+            ultimo = self.ultimo_confirmado
+            try:
+                if not em_casa:
+                    await mover_braco(clp, self.ponto_inicial, msg="Indo para o ponto inicial")
+                    em_casa = True
+                    self.partida = time.monotonic()
+
+                restantes = posicoes[self.ultimo_confirmado + 1:]
+                if stream:
+                    await mover_continuo(clp, restantes, confirmar=self._confirmar)
+                else:
+                    for pos in restantes:
+                        await mover_braco(clp, pos, msg="Movendo para posição acima do ponto",
+                                          confirmar=self._confirmar)
+
+                await mover_braco(clp, self.ponto_inicial, msg="Indo para o ponto inicial")
+                self._marcar()
+                return None if interrompido else self.tempos
+            except ConnectionError as e:
+                await self.descartar()
+                RECONNECTS.inc()
+                interrompido = True
+                # Give up if the link keeps dropping without the arm advancing
+                sem_progresso = sem_progresso + 1 if self.ultimo_confirmado == ultimo else 1
+                if sem_progresso >= RECONNECT_ATTEMPTS:
+                    self._marcar(e)
+                    raise
+                log.warning('Conexão perdida: %s. Retomando do ponto %d', e, self.ultimo_confirmado + 1)
+
+_sessao = None
+
+def obter_sessao():
+    """Return the shared CLP session, creating it on first use."""
+    global _sessao
+    if _sessao is None:
+        _sessao = SessaoCLP()
+    return _sessao
+
+async def makeDraw(posicoes, stream=STREAM_MODE, inicio=0, sessao=None):
+    """Draw `posicoes` on the arm of `sessao`, by default the one at CLP_IP.
+
+    `posicoes` is a point list or the path of a compiled job file (see
+    drawJobFile). A job file's progress is saved as it is drawn, so an
+    interrupted run can be resumed from where it stopped.
+    """
+    sessao = sessao or obter_sessao()
+    arquivo = None
+    progresso = None
+    proximo = inicio  # First waypoint of this call not acknowledged yet, never read from the shared session
+    if isinstance(posicoes, (str, os.PathLike)):
+        arquivo = posicoes
+        _, pontos = read_job(arquivo)
+        posicoes = pontos.tolist()  # The link encodes plain ints
+
+        def progresso(i):
+            nonlocal proximo
+            proximo = i + 1
+            if i + 1 == len(posicoes):
+                clear_progress(arquivo)  # Only the trip home is left, nothing to resume
+            elif (i + 1) % PROGRESSO_A_CADA == 0:
+                save_progress(arquivo, i + 1)
+    clp = f'{sessao.host}:{sessao.port}'
+    if stream:
+        event(log, 'desenho_inicio', clp=clp, pontos=len(posicoes), inicio=inicio, modo='continuo',
+              janela=STREAM_WINDOW, tolerancia=ARRIVAL_TOLERANCE)
+    else:
+        event(log, 'desenho_inicio', clp=clp, pontos=len(posicoes), inicio=inicio, modo='ponto_a_ponto')
 
-    mover_braco(clp, Ponto_inicial, msg="Indo para o ponto inicial")
+    inicio_desenho = time.monotonic()
+    resultado = 'erro'
+    try:
+        tempos = await sessao.executar(posicoes, stream, inicio, progresso)
+        resultado = 'ok'
+        return tempos
+    finally:
+        duracao = time.monotonic() - inicio_desenho
+        if arquivo is not None:
+            if resultado == 'ok' or proximo >= len(posicoes):
+                clear_progress(arquivo)
+            else:
+                save_progress(arquivo, proximo)
+        DRAW_SECONDS.observe(duracao, resultado=resultado)
+        event(log, 'desenho_fim', clp=clp, pontos=len(posicoes), segundos=f'{duracao:.1f}', resultado=resultado)
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the drawing arm's CLP.
+
+Speaks the same TCP protocol as the real controller: 25-byte move commands
+(a 1-byte flag followed by six 4-byte signed big-endian axes) come in, and
+16-byte position frames go out continuously, in the layout read by
+plcBridge.decodificar_quadro. Queued targets are reached one after another
+at a configurable per-axis speed, with configurable command latency and
+jitter.
+
+Run it next to the bot with CLP_IP=127.0.0.1:
+
+    python plcSimulator.py --port 2000 --speed 100
+
+or simulate a fleet of arms on consecutive ports and point ARM_FLEET at
+the arm list it writes:
+
+    python plcSimulator.py --port 2000 --count 3 --fleet fleet.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from plcBridge import Ponto_inicial
+
+COMMAND_SIZE = 25  # Flag byte plus six 4-byte axes
+
+
+def encode_frame(position):
+    """Build a 16-byte position frame: flag, three 3-byte and three 2-byte signed axes."""
+    axes = [int(round(v)) for v in position]
+    return (bytes([0])
+            + b''.join(v.to_bytes(3, 'big', signed=True) for v in axes[:3])
+            + b''.join(v.to_bytes(2, 'big', signed=True) for v in axes[3:]))
+
+
+def decode_command(data):
+    """Split a 25-byte move command into its flag and six axes."""
+    axes = [int.from_bytes(data[1 + 4 * i:5 + 4 * i], 'big', signed=True) for i in range(6)]
+    return data[0], axes
+
+
+class PLCSimulator:
+    """Simulated arm controller serving one TCP client at a time.
+
+    Args:
+        speed (float): Units per second each axis moves (mm for x, y and z)
+        latency (float): Seconds before a received command reaches the arm
+        jitter (float): Maximum random extra latency per command, in seconds
+        frame_interval (float): Seconds between position frames
+        start (list): Initial arm position [x, y, z, a, e, r]
+    """
+
+    def __init__(self, speed=100.0, latency=0.0, jitter=0.0, frame_interval=0.005, start=None):
+        self.speed = speed
+        self.latency = latency
+        self.jitter = jitter
+        self.frame_interval = frame_interval
+        self.position = [float(v) for v in (start or Ponto_inicial)]
+        self.incoming = deque()  # (arrival time, target) of commands still on their way
+        self.targets = deque()
+        self.server = None
+        self.clients = set()  # Connection handler tasks
+        self.closing = False
+        self.commands = 0
+        self.moving_time = 0.0
+        self.idle_time = 0.0
+
+    def reset_stats(self):
+        self.commands = 0
+        self.moving_time = 0.0
+        self.idle_time = 0.0
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening and return the bound port."""
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop listening and let every open connection finish."""
+        self.closing = True
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        await asyncio.gather(*self.clients)
+
+    def _step(self, now, elapsed):
+        """Hand over the commands that got through and advance the arm towards its target."""
+        while self.incoming and self.incoming[0][0] <= now:
+            self.targets.append(self.incoming.popleft()[1])
+        if not self.targets:
+            self.idle_time += elapsed
+            return
+        self.moving_time += elapsed
+        reach = self.speed * elapsed
+        target = self.targets[0]
+        if all(abs(t - p) <= reach for p, t in zip(self.position, target)):
+            self.position = list(target)
+            self.targets.popleft()
+        else:
+            self.position = [p + max(-reach, min(reach, t - p)) for p, t in zip(self.position, target)]
+
+    async def _receive(self, reader):
+        arrival = 0.0
+        try:
+            while True:
+                data = await reader.readexactly(COMMAND_SIZE)
+                _, target = decode_command(data)
+                self.commands += 1
+                # Delayed commands still reach the arm in the order they were sent
+                arrival = max(arrival, time.monotonic() + self.latency + random.uniform(0, self.jitter))
+                self.incoming.append((arrival, [float(v) for v in target]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _serve(self, reader, writer):
+        self.clients.add(asyncio.current_task())
+        receiver = asyncio.create_task(self._receive(reader))
+        last = time.monotonic()
+        try:
+            while not receiver.done() and not self.closing:
+                now = time.monotonic()
+                self._step(now, now - last)
+                last = now
+                writer.write(encode_frame(self.position))
+                await writer.drain()
+                await asyncio.sleep(self.frame_interval)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            receiver.cancel()
+            writer.close()
+            self.clients.discard(asyncio.current_task())
+
+
+async def _main(args):
+    arms = []
+    for i in range(args.count):
+        simulator = PLCSimulator(args.speed, args.latency, args.jitter)
+        port = await simulator.start(args.host, args.port + i if args.port else 0)
+        arms.append({'name': f'arm{i + 1}', 'host': args.host, 'port': port})
+        print(f'Simulated CLP listening on {args.host}:{port}')
+    if args.fleet:
+        with open(args.fleet, 'w') as f:
+            json.dump(arms, f, indent=2)
+        print(f'Arm list written to {args.fleet}')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local simulator of the drawing arm CLP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2000)
+    parser.add_argument('--speed', type=float, default=100.0, help='Axis speed in units per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='Command latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum extra random latency in seconds')
+    parser.add_argument('--count', type=int, default=1, help='Number of arms, on consecutive ports')
+    parser.add_argument('--fleet', help='Write an ARM_FLEET arm list for the simulated arms to this file')
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, fields
+from dotenv import load_dotenv
+
+# Load variables from .env into the environment
+load_dotenv()
+
+# Session limits and persistence
+SESSION_TTL = float(os.getenv('SESSION_TTL', '86400'))        # Seconds a user may stay idle in memory
+SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', '1000'))  # Users kept in memory at once
+SESSION_DB = os.getenv('SESSION_DB', 'sessions.db')            # SQLite file for parameters, empty to disable
+
+
+@dataclass(slots=True)
+class DrawParams:
+    """Drawing parameters of one user."""
+    process_cell_size: int = 1
+    points_cell_width: int = 1
+    z_up: int = -10
+    remove_background: bool = False
+    bg_threshold: int = 10
+    bg_erode_pixels: int = 1
+    threshold1: int = 50
+    threshold2: int = 191
+    blur_size: int = 3
+    distance_threshold: int = 3
+    epsilon: int = 1
+    linewidth: int = 5
+    optimize_path: bool = True
+    simplify_path: bool = True
+    quick_preview: bool = False
+
+    def as_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build from stored values, ignoring parameters that no longer exist."""
+        names = {f.name for f in fields(cls)}
+        return cls(**{name: value for name, value in data.items() if name in names})
+
+
+class SessionStore:
+    """Per-user drawing parameters with idle expiry, an LRU cap and optional SQLite persistence.
+
+    Only recently active users are kept in memory. Parameters that differ from
+    the defaults are written to SQLite when they change and read back the next
+    time the user shows up, so a restart or an eviction does not lose them.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_users=SESSION_MAX_USERS, db_path=SESSION_DB, on_evict=None):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.on_evict = on_evict  # Called with the user id of each evicted session
+        self.sessions = OrderedDict()  # user_id -> (DrawParams or None, last seen), least recently active first
+        self.db_path = db_path
+        self.db = None  # Opened by open(), parameters only live in memory until then
+
+    def open(self):
+        """Open (creating it if needed) the SQLite file. Does nothing without a db_path."""
+        if self.db is not None or not self.db_path:
+            return
+        self.db = sqlite3.connect(self.db_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS params (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    def _load(self, user_id):
+        if self.db is not None:
+            row = self.db.execute("SELECT data FROM params WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None:
+                return DrawParams.from_dict(json.loads(row[0]))
+        return DrawParams()
+
+    def params(self, user_id):
+        """The user's parameters, loading them from disk if they are not in memory."""
+        self.touch(user_id)
+        params, last_seen = self.sessions[user_id]
+        if params is None:
+            params = self._load(user_id)
+            self.sessions[user_id] = (params, last_seen)
+        return params
+
+    def touch(self, user_id):
+        """Mark the user as active, loading nothing until the parameters are needed."""
+        entry = self.sessions.pop(user_id, None)
+        self.sessions[user_id] = (entry[0] if entry is not None else None, time.monotonic())
+        self.evict()
+
+    def save(self, user_id):
+        """Persist the user's parameters after a change."""
+        if self.db is None or self.sessions.get(user_id, (None,))[0] is None:
+            return
+        params = self.sessions[user_id][0].as_dict()
+        defaults = DrawParams().as_dict()
+        changed = {name: value for name, value in params.items() if defaults[name] != value}
+        if changed:
+            self.db.execute(
+                "INSERT OR REPLACE INTO params (user_id, data, updated) VALUES (?, ?, ?)",
+                (user_id, json.dumps(changed), time.time())
+            )
+        else:
+            self.db.execute("DELETE FROM params WHERE user_id = ?", (user_id,))
+        self.db.commit()
+
+    def reset(self, user_id):
+        """Restore the default parameters."""
+        self.touch(user_id)
+        self.sessions[user_id] = (DrawParams(), time.monotonic())
+        self.save(user_id)
+
+    def evict(self):
+        """Drop sessions idle for longer than the TTL, then the least recently active past the cap."""
+        now = time.monotonic()
+        while self.sessions:
+            user_id, (_, last_seen) = next(iter(self.sessions.items()))
+            if now - last_seen <= self.ttl and len(self.sessions) <= self.max_users:
+                break
+            if len(self.sessions) == 1:
+                break  # Never evict the user being served
+            del self.sessions[user_id]
+            if self.on_evict is not None:
+                self.on_evict(user_id)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,80 @@
+"""
+DrawCache keys, hits and least-recently-used eviction in a scratch directory.
+
+    python -m unittest test_drawCache
+"""
+
+import os
+import tempfile
+import unittest
+from drawCache import DrawCache
+from drawJobs import DrawJob
+
+PARAMS = {'process_cell_size': 1, 'optimize_path': True, 'simplify_path': False}
+
+
+class DrawCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.root = scratch.name
+        self.cache = DrawCache(os.path.join(self.root, 'cache'))
+
+    def job(self, image=b'\x89PNG first', points=((170, 65, -118, -3, 88, -2), (180, 70, -118, -3, 88, -2))):
+        job = DrawJob(42, os.path.join(self.root, 'steps'))
+        with open(job.image_path, 'wb') as f:
+            f.write(image)
+        job.points = [list(p) for p in points]
+        job.params = dict(PARAMS)
+        job.reports = {'simplify': {'points_before': 4, 'points_after': 2}}
+        job.previews = {'contour.jpg': b'contour' * 100, 'draw.jpg': b'draw' * 100}
+        return job
+
+    def entry(self, key):
+        return os.path.join(self.cache.root, key)
+
+    def test_key_covers_image_parameters_and_settings(self):
+        first, second = self.job(), self.job(image=b'\x89PNG second')
+        key = self.cache.key(first.image_path, PARAMS, {'arm_resolution': 1.0})
+        self.assertEqual(key, self.cache.key(first.image_path, dict(PARAMS), {'arm_resolution': 1.0}))
+        self.assertNotEqual(key, self.cache.key(second.image_path, PARAMS, {'arm_resolution': 1.0}))
+        self.assertNotEqual(key, self.cache.key(first.image_path, dict(PARAMS, process_cell_size=2),
+                                                {'arm_resolution': 1.0}))
+        self.assertNotEqual(key, self.cache.key(first.image_path, PARAMS, {'arm_resolution': 2.0}))
+        # Booleans and their int form from /set are the same parameter value
+        self.assertEqual(key, self.cache.key(first.image_path, dict(PARAMS, optimize_path=1, simplify_path=0),
+                                             {'arm_resolution': 1.0}))
+
+    def test_hit_restores_the_results(self):
+        stored = self.job()
+        key = self.cache.key(stored.image_path, PARAMS)
+        self.cache.store(key, stored)
+
+        loaded = self.job(points=())
+        self.assertTrue(self.cache.load(key, loaded))
+        self.assertEqual(loaded.points, stored.points)
+        self.assertEqual(loaded.reports, stored.reports)
+        self.assertEqual(loaded.previews, stored.previews)
+        self.assertEqual(list(loaded.previews), list(stored.previews))  # Sending order too
+
+    def test_miss(self):
+        self.assertFalse(self.cache.load('0' * 64, self.job()))
+        self.assertFalse(os.path.exists(self.cache.root))  # Nothing is created until the first store
+
+    def test_evicts_the_least_recently_used_entry(self):
+        job = self.job()
+        self.cache.store('a', job)
+        size = sum(os.path.getsize(os.path.join(self.entry('a'), f)) for f in os.listdir(self.entry('a')))
+        self.cache.max_bytes = 2.5 * size
+        self.cache.store('b', job)
+        os.utime(self.entry('a'), (1, 1))
+        os.utime(self.entry('b'), (2, 2))
+
+        self.assertTrue(self.cache.load('a', self.job()))  # Now the most recently used
+        self.cache.store('c', job)
+        self.assertEqual(sorted(os.listdir(self.cache.root)), ['a', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
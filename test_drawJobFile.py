@@ -0,0 +1,146 @@
+"""
+.drawjob files: write/read round trip, validation and resume progress,
+including what makeDraw records when a drawing stops halfway.
+
+    python -m unittest test_drawJobFile
+"""
+
+import os
+import struct
+import tempfile
+import unittest
+import numpy as np
+from drawJobFile import (ALIGNMENT, PREAMBLE, VERSION, clear_progress, hash_file, load_progress, read_job,
+                         save_progress, write_job)
+from plcBridge import PROGRESSO_A_CADA, makeDraw
+
+POINTS = [[170, 65, -118, -3, 88, -2], [180, 70, -118, -3, 88, -2], [180, 70, -128, -3, 88, -2],
+          [200, 90, -128, -3, 88, -2], [200, 90, -118, -3, 88, -2], [210, 95, -118, -3, 88, -2],
+          [210, 95, -128, -3, 88, -2]]
+
+
+class FakeSession:
+    """Arm session that acknowledges waypoints until `parar_em`, then loses the link for good."""
+
+    host, port = '127.0.0.1', 2000
+
+    def __init__(self, parar_em=None):
+        self.parar_em = parar_em
+        self.inicio = None
+
+    async def executar(self, posicoes, stream, inicio, ao_confirmar=None):
+        self.inicio = inicio
+        for i in range(inicio, len(posicoes) + 1):  # The last step is the trip home
+            if i == self.parar_em:
+                raise ConnectionError('CLP indisponível')
+            if i < len(posicoes):
+                ao_confirmar(i)
+        return []
+
+
+class DrawJobFileTest(unittest.TestCase):
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.root = scratch.name
+        self.path = os.path.join(self.root, 'drawing.drawjob')
+
+    def test_round_trip(self):
+        image = os.path.join(self.root, 'input.png')
+        with open(image, 'wb') as f:
+            f.write(b'\x89PNG stub')
+        written = write_job(self.path, POINTS, {'process_cell_size': 2}, hash_file(image),
+                            [170, 65, -118, -3, 88, -2], [601, 403, -118, -3, 88, -2])
+
+        for mmap in (True, False):
+            with self.subTest(mmap=mmap):
+                header, waypoints = read_job(self.path, mmap=mmap)
+                self.assertEqual(waypoints.tolist(), POINTS)
+                self.assertEqual(waypoints.dtype, np.dtype('<i4'))
+                self.assertEqual(header, written)
+                self.assertEqual(header['strokes'], [0, 4])
+                self.assertEqual(header['params'], {'process_cell_size': 2})
+                self.assertEqual(header['source_sha256'], hash_file(image))
+        with open(self.path, 'rb') as f:
+            _, _, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        self.assertEqual((PREAMBLE.size + length) % ALIGNMENT, 0)  # Waypoints start aligned for the map
+
+    def test_rounds_float_points(self):
+        write_job(self.path, np.array(POINTS, dtype=float) + 0.4)
+        self.assertEqual(read_job(self.path)[1].tolist(), POINTS)
+
+    def test_empty_job(self):
+        header = write_job(self.path, [])
+        self.assertEqual((header['count'], header['strokes']), (0, []))
+        self.assertEqual(read_job(self.path)[1].shape, (0, 6))
+
+    def test_rejects_coordinates_past_int32(self):
+        with self.assertRaisesRegex(ValueError, 'int32'):
+            write_job(self.path, [[2 ** 31, 0, 0, 0, 0, 0]])
+        self.assertEqual(os.listdir(self.root), [])  # Nothing half written
+
+    def test_rejects_other_files(self):
+        write_job(self.path, POINTS)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        cases = {
+            'not a drawing job': b'GIF89a' + data[6:],
+            'truncated': data[:-4],
+            'version': struct.pack('<6sH', b'DRWJOB', VERSION + 1) + data[8:],
+        }
+        for message, damaged in cases.items():
+            with self.subTest(message):
+                with open(self.path, 'wb') as f:
+                    f.write(damaged)
+                with self.assertRaisesRegex(ValueError, message):
+                    read_job(self.path)
+
+    def test_progress(self):
+        self.assertEqual(load_progress(self.path), 0)
+        save_progress(self.path, 5)
+        self.assertEqual(load_progress(self.path), 5)
+        clear_progress(self.path)
+        clear_progress(self.path)  # Already gone is fine
+        self.assertEqual(load_progress(self.path), 0)
+
+        with open(f'{self.path}.progress', 'w') as f:
+            f.write('{')
+        self.assertEqual(load_progress(self.path), 0)
+
+
+class MakeDrawProgressTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.path = os.path.join(scratch.name, 'drawing.drawjob')
+        self.points = [[170 + i, 65, -118, -3, 88, -2] for i in range(3 * PROGRESSO_A_CADA)]
+        write_job(self.path, self.points)
+
+    async def test_an_interrupted_drawing_resumes_where_it_stopped(self):
+        with self.assertRaises(ConnectionError):
+            await makeDraw(self.path, stream=False, sessao=FakeSession(parar_em=PROGRESSO_A_CADA + 3))
+        self.assertEqual(load_progress(self.path), PROGRESSO_A_CADA + 3)
+
+        sessao = FakeSession()
+        await makeDraw(self.path, stream=False, inicio=load_progress(self.path), sessao=sessao)
+        self.assertEqual(sessao.inicio, PROGRESSO_A_CADA + 3)
+        self.assertEqual(load_progress(self.path), 0)  # Finished, nothing left to resume
+
+    async def test_a_drawing_that_never_started_keeps_its_progress(self):
+        save_progress(self.path, 5)
+        with self.assertRaises(ConnectionError):
+            await makeDraw(self.path, stream=False, inicio=5, sessao=FakeSession(parar_em=5))
+        self.assertEqual(load_progress(self.path), 5)
+
+    async def test_reaching_the_last_waypoint_clears_the_progress(self):
+        with self.assertRaises(ConnectionError):
+            # Fails on the way home, after the last waypoint was drawn
+            await makeDraw(self.path, stream=False, sessao=FakeSession(parar_em=len(self.points)))
+        self.assertEqual(load_progress(self.path), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
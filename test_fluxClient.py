@@ -0,0 +1,77 @@
+"""
+FluxClient against a stub of the image API, without any network access.
+
+    python -m unittest test_fluxClient
+"""
+
+import json
+import unittest
+import httpx
+from fluxClient import FluxClient, ImageGenerationError
+
+PNG = b'\x89PNG\r\n\x1a\nstub'
+
+
+class StubAPI:
+    """Answers each request with the next canned response, recording what was asked."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FluxClientTest(unittest.IsolatedAsyncioTestCase):
+
+    async def generate(self, stub, retries=2):
+        client = FluxClient('secret', url='https://flux.test/generate', retries=retries, backoff=0,
+                            transport=httpx.MockTransport(stub))
+        try:
+            return await client.generate('a cat wearing sunglasses')
+        finally:
+            await client.close()
+
+    async def test_returns_the_image(self):
+        stub = StubAPI(httpx.Response(200, content=PNG))
+        self.assertEqual(await self.generate(stub), PNG)
+        request = stub.requests[0]
+        self.assertEqual(request.headers['Authorization'], 'Bearer secret')
+        self.assertEqual(json.loads(request.content), {'inputs': 'a cat wearing sunglasses'})
+
+    async def test_retries_while_the_model_loads(self):
+        stub = StubAPI(httpx.Response(503, json={'error': 'loading', 'estimated_time': 0}),
+                       httpx.Response(429, headers={'Retry-After': '0'}),
+                       httpx.Response(200, content=PNG))
+        self.assertEqual(await self.generate(stub), PNG)
+        self.assertEqual(len(stub.requests), 3)
+
+    async def test_retries_network_errors(self):
+        stub = StubAPI(httpx.ConnectError('refused'), httpx.Response(200, content=PNG))
+        self.assertEqual(await self.generate(stub), PNG)
+
+    async def test_gives_up_after_the_last_retry(self):
+        stub = StubAPI(*[httpx.Response(503, json={'estimated_time': 0})] * 3)
+        with self.assertRaisesRegex(ImageGenerationError, '503'):
+            await self.generate(stub)
+        self.assertEqual(len(stub.requests), 3)
+
+    async def test_reports_the_api_error(self):
+        stub = StubAPI(httpx.Response(400, json={'error': 'prompt rejected'}))
+        with self.assertRaisesRegex(ImageGenerationError, 'prompt rejected'):
+            await self.generate(stub)
+        self.assertEqual(len(stub.requests), 1)
+
+    async def test_timeouts_become_image_errors(self):
+        stub = StubAPI(httpx.ReadTimeout('slow'))
+        with self.assertRaisesRegex(ImageGenerationError, 'timed out'):
+            await self.generate(stub, retries=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Path post-processing on synthetic drawings: decimation stays within its
+deviation bound and stroke reordering keeps every drawn segment.
+
+    python -m unittest test_pathOptimizer
+"""
+
+import unittest
+import numpy as np
+from pathOptimizer import COLLINEAR_TOLERANCE, join_strokes, optimize_stroke_order, path_stats, simplify_path, split_strokes
+
+Z_DOWN = -118
+Z_UP = -10
+UPPER_LEFT = [170, 65, Z_DOWN, -3, 88, -2]
+BOTTOM_RIGHT = [601, 403, Z_DOWN, -3, 88, -2]
+
+
+def random_strokes(count, seed=0):
+    """Random-walk pen-down strokes inside the drawing area."""
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for _ in range(count):
+        start = rng.integers([200, 100], [570, 370])
+        steps = rng.integers(-3, 4, size=(rng.integers(2, 40), 2))
+        xy = start + np.cumsum(steps, axis=0)
+        strokes.append([[int(x), int(y), Z_DOWN, -3, 88, -2] for x, y in xy])
+    return strokes
+
+
+def drawn_segments(points):
+    """Undirected pen-down segments of a path, as a set of xy point pairs."""
+    segments = set()
+    for stroke in split_strokes(points)[0]:
+        for a, b in zip(stroke, stroke[1:]):
+            if a[:2] != b[:2]:
+                segments.add(frozenset([tuple(a[:2]), tuple(b[:2])]))
+    return segments
+
+
+def distance_to_polyline(point, polyline):
+    """Distance in mm from an xy point to the closest segment of a polyline."""
+    p = np.asarray(point[:2], dtype=float)
+    xy = np.asarray(polyline, dtype=float)[:, :2]
+    if len(xy) == 1:
+        return float(np.hypot(*(p - xy[0])))
+    start, chord = xy[:-1], np.diff(xy, axis=0)
+    length_sq = np.maximum((chord ** 2).sum(axis=1), 1e-12)
+    along = np.clip(((p - start) * chord).sum(axis=1) / length_sq, 0, 1)
+    return float(np.hypot(*(p - (start + along[:, None] * chord)).T).min())
+
+
+class SimplifyPathTest(unittest.TestCase):
+
+    def test_original_points_stay_within_the_tolerance(self):
+        points = join_strokes(random_strokes(100), Z_UP, 0)
+        simplified, report = simplify_path(points, UPPER_LEFT, BOTTOM_RIGHT)
+        self.assertLess(report['points_after'], report['points_before'])
+        self.assertEqual(report['points_after'], len(simplified))
+
+        original, kept = split_strokes(points)[0], split_strokes(simplified)[0]
+        self.assertEqual(len(original), len(kept))
+        for before, after in zip(original, kept):
+            self.assertEqual((before[0], before[-1]), (after[0], after[-1]))
+            worst = max(distance_to_polyline(point, after) for point in before)
+            self.assertLessEqual(worst, COLLINEAR_TOLERANCE)
+
+    def test_keeps_the_pen_moves(self):
+        points = join_strokes(random_strokes(30, seed=2), Z_UP, 0)
+        simplified, _ = simplify_path(points, UPPER_LEFT, BOTTOM_RIGHT)
+        self.assertEqual([p for p in simplified if p[2] != Z_DOWN], [p for p in points if p[2] != Z_DOWN])
+
+    def test_a_straight_line_keeps_only_its_ends(self):
+        line = [[200 + i, 100 + 2 * i, Z_DOWN, -3, 88, -2] for i in range(50)]
+        simplified, _ = simplify_path(line, UPPER_LEFT, BOTTOM_RIGHT)
+        self.assertEqual(simplified, [line[0], line[-1]])
+
+    def test_clamps_to_the_workspace(self):
+        stroke = [[100, 50, Z_DOWN, -3, 88, -2], [400, 200, Z_DOWN, -3, 88, -2], [700, 500, Z_DOWN, -3, 88, -2]]
+        simplified, _ = simplify_path(stroke, UPPER_LEFT, BOTTOM_RIGHT)
+        self.assertEqual(simplified[0][:2], [170, 65])
+        self.assertEqual(simplified[-1][:2], [601, 403])
+
+
+class OptimizeStrokeOrderTest(unittest.TestCase):
+
+    def test_keeps_every_drawn_segment(self):
+        points = join_strokes(random_strokes(300), Z_UP, 0)  # Enough strokes for the KD-tree search
+        optimized, report = optimize_stroke_order(points, distance_threshold=3)
+
+        before, after = drawn_segments(points), drawn_segments(optimized)
+        self.assertLessEqual(before, after)
+        # The only new pen-down moves join strokes that end close to each other
+        for segment in after - before:
+            a, b = segment
+            self.assertLessEqual(np.hypot(a[0] - b[0], a[1] - b[1]), 3)
+
+        self.assertLess(report['travel_after'], report['travel_before'])
+        self.assertLessEqual(report['lifts_after'], report['lifts_before'])
+        self.assertGreater(report['time_saved'], 0)
+        self.assertEqual(path_stats(optimized)['lifts'], report['lifts_after'])
+
+    def test_ends_with_the_pen_up(self):
+        optimized, _ = optimize_stroke_order(join_strokes(random_strokes(20, seed=1), Z_UP, 0))
+        self.assertEqual(optimized[-1][2], Z_DOWN + Z_UP)
+
+    def test_a_single_stroke_is_left_alone(self):
+        points = join_strokes(random_strokes(1), Z_UP, 0)
+        optimized, report = optimize_stroke_order(points)
+        self.assertIs(optimized, points)
+        self.assertEqual(report['time_saved'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
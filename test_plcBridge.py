@@ -0,0 +1,146 @@
+"""
+plcBridge frame decoding, streamed moves and resumed drawings, against fake
+links and the local CLP simulator.
+
+    python -m unittest test_plcBridge
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+import plcBridge
+from plcBridge import LeitorQuadros, SessaoCLP, decodificar_quadro, decodificar_quadros, mover_stream
+from plcSimulator import PLCSimulator, encode_frame
+
+POSICOES = [[170, 65, -100, -3, 88, -2], [-8388608, 8388607, -1, -32768, 32767, 0], [601, 403, -128, 5, -90, 179]]
+
+_sleep = asyncio.sleep
+
+
+async def sem_espera(segundos, *args, **kwargs):
+    """asyncio.sleep without the arm's multi-second settling pauses."""
+    return await _sleep(min(segundos, 0.01), *args, **kwargs)
+
+
+class FakeCLP:
+    """Link whose arm walks through the published targets one frame at a time, recording what was sent."""
+
+    def __init__(self, posicao, quadros=None):
+        self.posicao = list(posicao)
+        self.quadros = list(quadros or [])  # Scripted frame batches, used before walking the targets
+        self.publicados = []
+        self.alcancados = 0
+
+    async def publicar(self, garra, lista):
+        self.publicados.append(list(lista))
+
+    async def LER_QUADROS(self, timeout=None):
+        if self.quadros:
+            return np.array(self.quadros.pop(0))
+        if self.alcancados < len(self.publicados):
+            self.posicao = self.publicados[self.alcancados]
+            self.alcancados += 1
+        await _sleep(0)
+        return np.array([self.posicao])
+
+
+class FrameDecodingTest(unittest.TestCase):
+
+    def test_bulk_decoder_matches_the_single_frame_one(self):
+        dados = b''.join(encode_frame(p) for p in POSICOES)
+        decodificados = decodificar_quadros(dados)
+        self.assertEqual(decodificados.shape, (3, 6))
+        self.assertEqual(decodificados.tolist(), POSICOES)
+        self.assertEqual([decodificar_quadro(dados[i:i + 16]) for i in range(0, len(dados), 16)], POSICOES)
+
+    def test_partial_frames_wait_for_the_rest(self):
+        dados = b''.join(encode_frame(p) for p in POSICOES)
+        leitor = LeitorQuadros()
+        recebidos = []
+        for i in range(0, len(dados), 7):  # Chunks that split frames at every offset
+            leitor.alimentar(dados[i:i + 7])
+            if leitor.pendentes():
+                recebidos.extend(leitor.quadros().tolist())
+        self.assertEqual(recebidos, POSICOES)
+        self.assertEqual(leitor.pendentes(), 0)
+        self.assertEqual(len(leitor.buffer), 0)
+
+    def test_trailing_bytes_are_kept(self):
+        dados = encode_frame(POSICOES[0]) + encode_frame(POSICOES[1])[:10]
+        leitor = LeitorQuadros()
+        leitor.alimentar(dados)
+        self.assertEqual(leitor.quadros().tolist(), POSICOES[:1])
+        self.assertEqual(len(leitor.buffer), 10)
+        leitor.alimentar(encode_frame(POSICOES[1])[10:])
+        self.assertEqual(leitor.quadros().tolist(), POSICOES[1:2])
+
+
+class MoverStreamTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_keeps_the_window_and_confirms_in_order(self):
+        posicoes = [[170 + i, 65, -100, -3, 88, -2] for i in range(1, 11)]
+        clp = FakeCLP(plcBridge.Ponto_inicial)
+        em_voo = []
+
+        def confirmar():
+            em_voo.append(len(clp.publicados) - len(em_voo))  # Waypoints sent and not confirmed yet
+
+        await mover_stream(clp, posicoes, janela=3, tolerancia=0, confirmar=confirmar)
+        self.assertEqual(clp.publicados, posicoes)
+        self.assertEqual(len(em_voo), len(posicoes))
+        self.assertLessEqual(max(em_voo), 3)
+
+    async def test_a_later_waypoint_does_not_release_earlier_ones(self):
+        posicoes = [[200, 65, -100, -3, 88, -2], [210, 65, -100, -3, 88, -2], [170, 65, -100, -3, 88, -2]]
+        # The arm sits on the last waypoint before going anywhere, then passes all three within one read
+        clp = FakeCLP(posicoes[-1], quadros=[[posicoes[-1]], posicoes])
+        confirmados = []
+        await mover_stream(clp, posicoes, janela=3, tolerancia=0, confirmar=lambda: confirmados.append(clp.quadros[:]))
+        self.assertEqual(len(confirmados), 3)
+        self.assertTrue(all(restantes == [] for restantes in confirmados))  # None of them on the first read
+
+    async def test_gives_up_when_the_arm_stalls(self):
+        clp = FakeCLP(plcBridge.Ponto_inicial, quadros=[[plcBridge.Ponto_inicial]] * 1000)
+        with self.assertRaisesRegex(ConnectionError, 'não alcançou'):
+            await mover_stream(clp, [[300, 65, -100, -3, 88, -2]], limite=0)
+
+
+@mock.patch('asyncio.sleep', sem_espera)
+@mock.patch.object(SessaoCLP, 'iniciar_heartbeat', lambda self: None)  # Would run every few ms without the pauses
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.simulador = PLCSimulator(speed=5000)
+        porta = await self.simulador.start()
+        self.sessao = SessaoCLP('127.0.0.1', porta)
+        self.posicoes = [[170 + 5 * i, 65, -100 if i % 4 else -110, -3, 88, -2] for i in range(1, 13)]
+
+    async def asyncTearDown(self):
+        await self.sessao.encerrar()
+        await self.simulador.close()
+
+    async def test_resumes_from_the_first_unconfirmed_waypoint(self):
+        for stream in (False, True):
+            with self.subTest(stream=stream):
+                confirmados = []
+
+                def ao_confirmar(i):
+                    confirmados.append(i)
+                    if i == 5 and len(confirmados) == 6:
+                        self.sessao.clp.writer.transport.abort()  # The link drops halfway through the drawing
+
+                tempos = await self.sessao.executar(self.posicoes, stream, ao_confirmar=ao_confirmar)
+                self.assertEqual(confirmados, list(range(len(self.posicoes))))
+                self.assertIsNone(tempos)  # Interrupted, so the timings are not the arm's speed
+                self.assertEqual(self.simulador.position, [float(v) for v in plcBridge.Ponto_inicial])
+
+    async def test_starts_at_the_given_waypoint(self):
+        confirmados = []
+        await self.sessao.executar(self.posicoes, False, inicio=8, ao_confirmar=confirmados.append)
+        self.assertEqual(confirmados, list(range(8, len(self.posicoes))))
+        self.assertEqual(self.simulador.commands, 2 + len(self.posicoes) - 8)  # Home, the rest, home again
+
+
+if __name__ == '__main__':
+    unittest.main()
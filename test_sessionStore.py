@@ -0,0 +1,115 @@
+"""
+SessionStore expiry, LRU cap and SQLite persistence, on a fake clock and a
+scratch database.
+
+    python -m unittest test_sessionStore
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from unittest import mock
+from sessionStore import DrawParams, SessionStore
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('sessionStore.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.db_path = os.path.join(scratch.name, 'sessions.db')
+        self.evicted = []
+
+    def store(self, max_users=10):
+        store = SessionStore(ttl=60, max_users=max_users, db_path=self.db_path, on_evict=self.evicted.append)
+        self.addCleanup(store.close)
+        return store
+
+    def test_idle_sessions_expire(self):
+        store = self.store()
+        store.params(1).threshold1 = 80
+        self.clock.now += 61
+        store.touch(2)
+        self.assertEqual(list(store.sessions), [2])
+        self.assertEqual(self.evicted, [1])
+        self.assertEqual(store.params(1).threshold1, 50)  # Never saved, so back to the default
+
+    def test_the_user_being_served_is_kept(self):
+        store = self.store()
+        store.touch(1)
+        self.clock.now += 3600
+        store.touch(1)
+        self.assertEqual(list(store.sessions), [1])
+        self.assertEqual(self.evicted, [])
+
+    def test_least_recently_active_goes_first(self):
+        store = self.store(max_users=2)
+        store.touch(1)
+        store.touch(2)
+        store.params(1)  # 1 is active again, 2 is now the oldest
+        store.touch(3)
+        self.assertEqual(list(store.sessions), [1, 3])
+        self.assertEqual(self.evicted, [2])
+
+    def test_changed_parameters_survive_a_restart(self):
+        store = self.store()
+        store.open()
+        store.params(7).threshold1 = 80
+        store.params(7).remove_background = True
+        store.save(7)
+        store.close()
+
+        restarted = self.store()
+        restarted.open()
+        params = restarted.params(7)
+        self.assertEqual(params.threshold1, 80)
+        self.assertTrue(params.remove_background)
+        self.assertEqual(params.blur_size, DrawParams().blur_size)
+
+        # Only the values that differ from the defaults are stored, and a reset removes the row
+        with closing(sqlite3.connect(self.db_path)) as db:
+            stored = json.loads(db.execute("SELECT data FROM params").fetchone()[0])
+        self.assertEqual(stored, {'remove_background': True, 'threshold1': 80})
+        restarted.reset(7)
+        with closing(sqlite3.connect(self.db_path)) as db:
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM params").fetchone()[0], 0)
+
+    def test_evicted_users_are_reloaded_from_disk(self):
+        store = self.store(max_users=1)
+        store.open()
+        store.params(1).linewidth = 9
+        store.save(1)
+        store.touch(2)
+        self.assertNotIn(1, store.sessions)
+        self.assertEqual(store.params(1).linewidth, 9)
+
+    def test_nothing_is_written_before_open(self):
+        store = self.store()
+        store.params(1).threshold1 = 80
+        store.save(1)
+        self.assertFalse(os.path.exists(self.db_path))
+
+    def test_stored_parameters_that_no_longer_exist_are_ignored(self):
+        params = DrawParams.from_dict({'threshold1': 70, 'retired_option': 3})
+        self.assertEqual(params.threshold1, 70)
+
+
+if __name__ == '__main__':
+    unittest.main()
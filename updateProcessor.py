@@ -0,0 +1,88 @@
+"""
+Concurrent handling of Telegram updates.
+
+By default python-telegram-bot handles one update at a time, so a slow
+handler (an LLM reply, say) delays every user queued behind it. The
+processor below handles updates from different users concurrently while
+each user's own updates still run one at a time, in arrival order, which
+is what ConversationHandler needs to keep every conversation's state
+consistent.
+"""
+
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from telegram.ext import BaseUpdateProcessor
+from metrics import Histogram
+
+# Load variables from .env into the environment
+load_dotenv()
+
+UPDATE_MAX_IN_FLIGHT = int(os.getenv('UPDATE_MAX_IN_FLIGHT', '32'))  # Updates handled at once, over all users
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '512'))     # Updates accepted before intake pauses
+
+UPDATE_WAIT_SECONDS = Histogram('bot_update_wait_seconds', 'Time an update waited for its turn before being handled')
+
+
+def _sender(update):
+    """Key of the conversation an update belongs to, as ConversationHandler keys it (chat, user)."""
+    chat = getattr(update, 'effective_chat', None)
+    user = getattr(update, 'effective_user', None)
+    if chat is None and user is None:
+        return None
+    return (chat.id if chat else None, user.id if user else None)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handle different users' updates concurrently and each user's updates in order.
+
+    Args:
+        max_in_flight (int): Updates being handled at the same time, over all users
+        max_pending (int): Updates accepted, running or waiting, before new ones are held back
+
+    An update waiting behind its own user's previous one does not take an
+    in-flight slot, so one busy user cannot starve the others.
+    """
+
+    def __init__(self, max_in_flight=UPDATE_MAX_IN_FLIGHT, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending, max_in_flight))
+        self.max_in_flight = max_in_flight
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.senders = {}  # Conversation key -> [lock, updates holding or waiting for it]
+        self.running = 0
+
+    @property
+    def pending(self):
+        """Updates accepted but not being handled yet."""
+        return self.current_concurrent_updates - self.running
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        key = _sender(update)
+        if key is None:
+            async with self.in_flight:
+                await coroutine
+            return
+
+        sender = self.senders.setdefault(key, [asyncio.Lock(), 0])
+        sender[1] += 1
+        queued = time.perf_counter()
+        try:
+            # asyncio.Lock wakes waiters first come, first served
+            async with sender[0], self.in_flight:
+                UPDATE_WAIT_SECONDS.observe(time.perf_counter() - queued)
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            sender[1] -= 1
+            if not sender[1]:
+                del self.senders[key]